@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+from collections import defaultdict
+from multiprocessing import Pool
+import numpy as np
+import segments
+from snapshot import Interner
+
+
+MATCH, SUBSTITUTE, DELETE, INSERT = range(4)
+
+EMPTY = "∅"
+BOUNDARY = "#"
+
+SHARD_SIZE = 2048
+
+
+def encode(forms, interner, pad):
+    """Pad lists of segments into an (N, max length) array of ids."""
+    lengths = np.array([len(form) for form in forms], dtype=np.int64)
+    ids = np.full((len(forms), max(lengths.max(initial=0), 1)), pad, dtype=np.int32)
+    for idx, form in enumerate(forms):
+        ids[idx, :len(form)] = [interner(segment) for segment in form]
+    return ids, lengths
+
+
+def distances(a, b):
+    """Levenshtein distance tables for every pair of rows of `a` and `b` at
+    once: D[n, i, j] is the distance between the first i ids of a[n] and
+    the first j of b[n].
+
+    Each row of the table follows from the previous one in a handful of
+    array operations: substitutions and deletions elementwise, and chains
+    of insertions as a running minimum of D - j."""
+    n, length_a = a.shape
+    length_b = b.shape[1]
+    cost = (a[:, :, None] != b[:, None, :]).astype(np.int32)
+
+    columns = np.arange(length_b + 1, dtype=np.int32)
+    table = np.empty((n, length_a + 1, length_b + 1), dtype=np.int32)
+    table[:, 0, :] = columns
+
+    for i in range(1, length_a + 1):
+        prev = table[:, i - 1, :]
+        row = np.empty((n, length_b + 1), dtype=np.int32)
+        row[:, 0] = i
+        np.minimum(prev[:, 1:] + 1, prev[:, :-1] + cost[:, i - 1, :], out=row[:, 1:])
+        table[:, i, :] = np.minimum.accumulate(row - columns, axis=1) + columns
+
+    return table
+
+
+def backtrace(table, a, b, lengths_a, lengths_b):
+    """Walk every table back from (len a, len b) in lockstep. Ties go to
+    matches, then deletions, then insertions, then substitutions, so that
+    the same error aligns the same way wherever it occurs. Returns the edit
+    operations of each pair, in order, as (op, a id, b id, position in a)."""
+    n = len(a)
+    rows = np.arange(n)
+    i, j = lengths_a.copy(), lengths_b.copy()
+
+    steps = []
+    while True:
+        active = (i > 0) | (j > 0)
+        if not active.any():
+            break
+
+        prev_i, prev_j = np.maximum(i - 1, 0), np.maximum(j - 1, 0)
+        a_ids, b_ids = a[rows, prev_i], b[rows, prev_j]
+        here = table[rows, i, j]
+
+        both = (i > 0) & (j > 0)
+        match = both & (a_ids == b_ids) & (here == table[rows, prev_i, prev_j])
+        delete = ~match & (i > 0) & (here == table[rows, prev_i, j] + 1)
+        insert = ~match & ~delete & (j > 0) & (here == table[rows, i, prev_j] + 1)
+        substitute = active & ~match & ~delete & ~insert
+        diagonal = match | substitute
+
+        op = np.full(n, MATCH)
+        op[substitute] = SUBSTITUTE
+        op[delete] = DELETE
+        op[insert] = INSERT
+
+        changed = np.flatnonzero(op != MATCH)
+        steps.append((changed, op[changed], a_ids[changed], b_ids[changed],
+                      np.where(insert, i, prev_i)[changed]))
+
+        i = i - (diagonal | delete)
+        j = j - (diagonal | insert)
+
+    ops = [[] for _ in range(n)]
+    for changed, op, a_ids, b_ids, positions in reversed(steps):
+        for row, op_, a_id, b_id, position in zip(
+                changed.tolist(), op.tolist(), a_ids.tolist(), b_ids.tolist(), positions.tolist()):
+            ops[row].append((op_, a_id, b_id, position))
+    return ops
+
+
+def label(op, source, target, position, length):
+    """(source side, target side) of an edit, marked # at the edges of the
+    source form."""
+    if op == INSERT:
+        source = EMPTY
+        initial, final = position == 0, position == length
+    else:
+        initial, final = position == 0, position == length - 1
+    if op == DELETE:
+        target = EMPTY
+
+    prefix = BOUNDARY if initial else ""
+    suffix = BOUNDARY if final else ""
+    return prefix + source + suffix, prefix + target + suffix
+
+
+def edits(pairs):
+    """[(source side, target side)] of each (source, target) pair of segment
+    lists, one label per edit, in order."""
+    if not pairs:
+        return []
+
+    interner = Interner()
+    a, lengths_a = encode([source for source, _ in pairs], interner, -1)
+    b, lengths_b = encode([target for _, target in pairs], interner, -2)
+
+    ops = backtrace(distances(a, b), a, b, lengths_a, lengths_b)
+    strings = interner.strings
+    return [
+        [
+            label(op, strings[a_id] if a_id >= 0 else "", strings[b_id] if b_id >= 0 else "",
+                  position, len(source))
+            for op, a_id, b_id, position in pair_ops
+        ]
+        for (source, _), pair_ops in zip(pairs, ops)
+    ]
+
+
+def cluster_key(pair_edits):
+    return (
+        " ".join(source for source, _ in pair_edits),
+        " ".join(target for _, target in pair_edits),
+    )
+
+
+def _cluster_keys(pairs):
+    return [cluster_key(pair_edits) for pair_edits in edits(pairs)]
+
+
+class Clusters:
+    """Incorrect predictions clustered by their edits from the correct SR.
+
+    Each prediction is aligned segment by segment to the correct SR, and
+    its cluster is the sequence of edits (substitutions, insertions and
+    deletions, marked # at word edges) that turn one into the other, e.g.
+    t# -> d# for a final devoicing gone the wrong way.
+    """
+
+    def __init__(self, examples, keys):
+        # cluster -> [(UR, correct SR, incorrect SR)], in input order
+        self.index = defaultdict(list)
+        for example, key in zip(examples, keys):
+            self.index[key].append(example)
+
+    @classmethod
+    def from_dicts(cls, correct, incorrect, tokenizer=None, jobs=1):
+        """Cluster the URs in both dicts of UR to SR whose SRs differ."""
+        tokenizer = tokenizer or segments.default()
+        examples = [
+            (ur, correct_sr, incorrect[ur])
+            for ur, correct_sr in correct.items()
+            if ur in incorrect and incorrect[ur] != correct_sr
+        ]
+        pairs = [
+            (tokenizer(correct_sr), tokenizer(incorrect_sr))
+            for _, correct_sr, incorrect_sr in examples
+        ]
+
+        if jobs > 1:
+            shards = [pairs[idx:idx + SHARD_SIZE] for idx in range(0, len(pairs), SHARD_SIZE)]
+            with Pool(jobs) as pool:
+                keys = [key for shard in pool.map(_cluster_keys, shards) for key in shard]
+        else:
+            keys = [
+                key for idx in range(0, len(pairs), SHARD_SIZE)
+                for key in _cluster_keys(pairs[idx:idx + SHARD_SIZE])
+            ]
+
+        return cls(examples, keys)
+
+    @classmethod
+    def from_files(cls, correct_file, incorrect_file, jobs=1):
+        tokenizer = segments.default()
+
+        def to_dict(path):
+            return {
+                "".join(ur): "".join(sr)
+                for ur, sr in tokenizer.tokenize_file(path)
+            }
+
+        return cls.from_dicts(
+            to_dict(correct_file), to_dict(incorrect_file), tokenizer=tokenizer, jobs=jobs)
+
+    def counts(self):
+        """[(cluster, count)], largest first."""
+        return sorted(
+            ((key, len(examples)) for key, examples in self.index.items()),
+            key=lambda item: item[1], reverse=True)
+
+    def urs(self, key):
+        return [ur for ur, _, _ in self.index.get(key, [])]
+
+    def write(self, file=sys.stdout, tokenizer=None):
+        """The collect-dist report: a line per cluster of its source side,
+        target side and count, followed by its examples, the most syllables
+        and then final stress first."""
+        tokenizer = tokenizer or segments.default()
+
+        def example_order(example):
+            ur = tokenizer(example[0])
+            final_syl = ur[len(ur) - ur[::-1].index(segments.SYLL):] \
+                if segments.SYLL in ur else ur
+            return ur.count(segments.SYLL), segments.STRESS in final_syl
+
+        for (source, target), count in self.counts():
+            print(source + "\t" + target + "\t" + str(count), file=file)
+            for ur, correct, incorrect in sorted(
+                    self.index[(source, target)], key=example_order, reverse=True):
+                print("\t\t" + ur + "\t" + correct + "\t" + incorrect, file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cluster incorrect predictions by their alignment to the correct SRs.")
+    parser.add_argument("correct", type=str, help="UR and correct SR per line")
+    parser.add_argument("incorrect", type=str, help="UR and predicted SR per line")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="align across this many worker processes")
+    args = parser.parse_args()
+
+    Clusters.from_files(args.correct, args.incorrect, jobs=args.jobs).write()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import itertools
+from collections import deque
+from multiprocessing import Pool
+from tabulate import BIG_GRAMMAR, UR_LEXICON
+from service import Generator, UnknownTag
+
+CHUNK_SIZE = 1000
+
+# Chunks in flight per worker.
+CHUNKS_PER_JOB = 4
+
+
+def read_words(paths):
+    """Words, one per line, from the files in turn (- for stdin)."""
+    for path in paths or ['-']:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                yield line.strip()
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_result(word, result, up=False, trace=False):
+    """word, then its SRs (URs with up), then its derivation with trace, tab
+    separated. Blank words stay blank lines."""
+    if not word:
+        return ''
+    fields = [word] + result['urs' if up else 'srs']
+    if trace and not up:
+        fields.append(result['derivation'])
+    return '\t'.join(fields)
+
+
+def apply_chunk(generator, words, up=False, trace=False):
+    """Output lines for the words. A word with an unknown tag is reported
+    on stderr and written without SRs, and the rest carry on."""
+    apply = generator.analyze if up else generator.generate
+    lines = []
+    for word in words:
+        try:
+            result = apply(word, trace=trace) if word else None
+        except UnknownTag as e:
+            sys.stderr.write("apply.py: %s\n" % e)
+            lines.append(word)
+            continue
+        lines.append(format_result(word, result, up=up, trace=trace))
+    return lines
+
+
+# The generator of an apply worker process, loaded once by _init_worker.
+_worker_generator = None
+
+
+def _init_worker(grammar_file_name, ur_lexicon, table):
+    global _worker_generator
+    _worker_generator = Generator.from_files(grammar_file_name, ur_lexicon, table=table)
+
+
+def _apply_chunk(args):
+    words, up, trace = args
+    return apply_chunk(_worker_generator, words, up=up, trace=trace)
+
+
+def ordered(pool, fn, iterable, window):
+    """pool.imap, but reading no more than `window` items ahead of the
+    results: imap's feeder thread would drain the whole input into the task
+    queue."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(fn, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def apply(words, grammar_file_name=BIG_GRAMMAR, ur_lexicon=UR_LEXICON,
+          up=False, trace=False, jobs=1, chunk_size=CHUNK_SIZE, table=True):
+    """Yield an output line per word, in input order.
+
+    Words are read and run a chunk at a time. With jobs > 1, chunks are
+    spread over worker processes that each compile the grammar once, with
+    at most a few chunks per worker in flight, so memory stays constant
+    however long the input is."""
+    if jobs > 1:
+        if table:
+            # Build the lookup table once, before the workers load it.
+            from lookup import LookupTable
+            LookupTable.load_or_build(grammar_file_name, ur_lexicon)
+
+        with Pool(jobs, initializer=_init_worker,
+                  initargs=(grammar_file_name, ur_lexicon, table)) as pool:
+            tasks = ((chunk, up, trace) for chunk in chunked(words, chunk_size))
+            for lines in ordered(pool, _apply_chunk, tasks, jobs * CHUNKS_PER_JOB):
+                yield from lines
+    else:
+        generator = Generator.from_files(grammar_file_name, ur_lexicon, table=table)
+        for chunk in chunked(words, chunk_size):
+            yield from apply_chunk(generator, chunk, up=up, trace=trace)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the grammar over a word list: URs (e.g. ə-βə-1lid+Fem) "
+                    "down to SRs, or with --up, SRs up to URs.")
+    parser.add_argument("files", type=str, nargs="*",
+                        help="word lists, one word per line (stdin by default)")
+    parser.add_argument("--up", action="store_true", help="analyze SRs into URs")
+    parser.add_argument("--trace", action="store_true",
+                        help="add each UR's derivation as a last column")
+    parser.add_argument("--grammar", type=str, default=BIG_GRAMMAR)
+    parser.add_argument("--ur-lexicon", type=str, default=UR_LEXICON,
+                        help="for tag suffixes and analyses")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="apply across this many worker processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="words per task")
+    parser.add_argument("--no-table", action="store_true",
+                        help="run every word through the grammar rather than "
+                             "the precomputed lexicon table")
+    args = parser.parse_args()
+
+    write = sys.stdout.write
+    for line in apply(
+            read_words(args.files), args.grammar, args.ur_lexicon,
+            up=args.up, trace=args.trace, jobs=args.jobs,
+            chunk_size=args.chunk_size, table=not args.no_table):
+        write(line + '\n')
+
+
+if __name__ == "__main__":
+    main()
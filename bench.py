@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import itertools
+import tracemalloc
+from contextlib import contextmanager
+from corpus import Corpus, OrthBank, PhonBank, DATA_DIR
+from snapshot import CACHE_DIR
+
+BENCH_DIR = os.path.join(CACHE_DIR, "bench")
+SCALES = [1, 10, 100]
+
+# Orth/phon pairs for the syllables prefixed to lemmas in each synthetic
+# copy of the corpus, spelled so that epitran and the SAMPA map agree.
+ONSETS = [("b", "b"), ("d", "d"), ("f", "f"), ("m", "m"),
+          ("n", "n"), ("p", "p"), ("t", "t"), ("l", "l")]
+NUCLEI = [("a", "a"), ("i", "i"), ("u", "u")]
+SYLLABLES = [
+    (onset + nucleus, "%s %s -" % (onset_phon, nucleus_phon))
+    for (onset, onset_phon), (nucleus, nucleus_phon) in itertools.product(ONSETS, NUCLEI)
+]
+
+TRANSLITERATE_SAMPLE = 1000
+
+
+def prefix(copy):
+    """The orth and phon prefix for a copy of the corpus; copy 0 is the
+    original."""
+    orth, phon = "", ""
+    while copy:
+        copy, digit = divmod(copy - 1, len(SYLLABLES))
+        syllable_orth, syllable_phon = SYLLABLES[digit]
+        orth = syllable_orth + orth
+        phon = syllable_phon + " " + phon
+    return orth, phon
+
+
+def generate(scale, directory=None):
+    """Write adj.orth and adj.phon at `scale` times the size of the real
+    corpus, each copy with its lemmas and inflections given a distinct
+    prefix. Returns the directory; existing corpora are reused."""
+    directory = directory or os.path.join(BENCH_DIR, "%dx" % scale)
+    orth_path = os.path.join(directory, OrthBank.FILE)
+    phon_path = os.path.join(directory, PhonBank.FILE)
+
+    if os.path.exists(orth_path) and os.path.exists(phon_path):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(DATA_DIR, OrthBank.FILE)) as f:
+        orth_rows = [line.split() for line in f]
+    with open(os.path.join(DATA_DIR, PhonBank.FILE)) as f:
+        phon_rows = [line.rstrip("\n") + "\n" for line in f]
+
+    with open(orth_path + ".tmp", "w") as orth_f, open(phon_path + ".tmp", "w") as phon_f:
+        for copy in range(scale):
+            orth_prefix, phon_prefix = prefix(copy)
+            for (infl, lemma, key), phon in zip(orth_rows, phon_rows):
+                orth_f.write("%s%s %s%s %s\n" % (orth_prefix, infl, orth_prefix, lemma, key))
+                phon_f.write(phon_prefix + phon)
+
+    os.replace(orth_path + ".tmp", orth_path)
+    os.replace(phon_path + ".tmp", phon_path)
+    return directory
+
+
+@contextmanager
+def corpus_files(directory, scale):
+    """Point the banks at a synthetic corpus, with its own snapshot name so
+    the real corpus's snapshot is left alone."""
+    saved = OrthBank.PATH, PhonBank.PATH, Corpus.SNAPSHOT
+    OrthBank.PATH = os.path.join(directory, OrthBank.FILE)
+    PhonBank.PATH = os.path.join(directory, PhonBank.FILE)
+    Corpus.SNAPSHOT = "bench.%dx" % scale
+    try:
+        yield
+    finally:
+        OrthBank.PATH, PhonBank.PATH, Corpus.SNAPSHOT = saved
+
+
+def measure(fn, memory=True):
+    """(result, wall seconds, peak traced bytes or None). Wall time is taken
+    from an untraced call; tracemalloc slows allocation-heavy code down, so
+    the peak comes from a second, traced call."""
+    start = time.perf_counter()
+    result = fn()
+    wall = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return result, wall, peak
+
+
+class Bench:
+    """Run each stage of the pipeline over a synthetic corpus."""
+
+    CORPUS_STAGES = [
+        "Corpus",
+        "Corpus.snapshot_build",
+        "Corpus.snapshot_load",
+        "Corpus.streaming",
+        "get_ur_to_infl",
+        "format_UR_lexicon",
+        "format_SR_lexicon",
+        "transliterate",
+    ]
+    GRAMMAR_STAGES = [
+        "applicable_rules_for_word",
+        "tabulate",
+        "write_tabulation_count",
+        "write_tabulation_examples",
+    ]
+    STAGES = CORPUS_STAGES + GRAMMAR_STAGES
+
+    def __init__(self, scale, grammar_file_name=None, stages=None, memory=True):
+        self.scale = scale
+        self.grammar_file_name = grammar_file_name
+        self.stages = stages or self.STAGES
+        self.memory = memory
+        self.directory = generate(scale)
+        self.results = []
+
+    def record(self, stage, fn, rows=None):
+        if stage not in self.stages:
+            return None
+        result, wall, peak = measure(fn, memory=self.memory)
+        self.results.append({
+            "stage": stage,
+            "scale": self.scale,
+            "rows": rows(result) if rows else None,
+            "wall_s": wall,
+            "peak_bytes": peak,
+        })
+        print("%-28s %4dx %10.3f s" % (stage, self.scale, wall), file=sys.stderr)
+        return result
+
+    def run(self):
+        with corpus_files(self.directory, self.scale):
+            self.run_corpus()
+        if any(stage in self.stages for stage in self.GRAMMAR_STAGES):
+            self.run_grammar()
+        return self.results
+
+    def run_corpus(self):
+        def build():
+            return Corpus(True, True, use_snapshot=False)
+
+        corpus = self.record(
+            "Corpus", build, rows=lambda corpus: len(corpus.orth_bank.rows))
+        if corpus is None:
+            corpus = build()
+        self.corpus = corpus
+
+        def build_snapshot():
+            for snap in os.listdir(CACHE_DIR):
+                if snap.startswith(Corpus.SNAPSHOT + "."):
+                    os.remove(os.path.join(CACHE_DIR, snap))
+            return Corpus(True, True)
+
+        self.record("Corpus.snapshot_build", build_snapshot)
+        self.record("Corpus.snapshot_load", lambda: Corpus(True, True))
+        self.record("Corpus.streaming", lambda: Corpus(True, True, streaming=True))
+
+        self.record("get_ur_to_infl", corpus.get_ur_to_infl, rows=len)
+        self.ur_lexicon = self.record("format_UR_lexicon", corpus.format_UR_lexicon)
+        self.sr_lexicon = self.record("format_SR_lexicon", corpus.format_SR_lexicon)
+
+        sample = [
+            row[OrthBank.INFL] for row in itertools.islice(
+                corpus.orth_bank, TRANSLITERATE_SAMPLE * self.scale)
+        ]
+        epi = corpus.epi
+        self.record("transliterate",
+                    lambda: [epi.transliterate(word) for word in sample], rows=len)
+
+    def run_grammar(self):
+        # pyfoma is only needed for the grammar stages.
+        from evaluation import Evaluation
+        from tabulate import Tabulator, BIG_GRAMMAR
+
+        grammar_file_name = self.grammar_file_name or BIG_GRAMMAR
+
+        ur_lexicon = os.path.join(self.directory, "ur.lexicon.lexc")
+        sr_lexicon = os.path.join(self.directory, "sr.lexicon.lexc")
+        for path, text, format_lexicon in [
+            (ur_lexicon, getattr(self, "ur_lexicon", None), self.corpus.format_UR_lexicon),
+            (sr_lexicon, getattr(self, "sr_lexicon", None), self.corpus.format_SR_lexicon),
+        ]:
+            with open(path, "w") as f:
+                f.write(text if text is not None else format_lexicon())
+
+        evaluation = Evaluation.from_files(
+            grammar_file_name, ur_lexicon=ur_lexicon, sr_lexicon=sr_lexicon)
+        ruleset = evaluation.ruleset
+        urs = [upper.encode() for upper, _ in evaluation.ur_pairs]
+
+        def applicable_rules():
+            ruleset.transduce_all.cache_clear()
+            return [ruleset.applicable_rules_for_word(ur) for ur in urs]
+
+        self.record("applicable_rules_for_word", applicable_rules, rows=len)
+
+        def tabulator():
+            return Tabulator(
+                grammar_file_name=grammar_file_name,
+                predictions=evaluation.prediction_dicts,
+                ruleset=ruleset)
+
+        def tabulate():
+            ruleset.transduce_all.cache_clear()
+            tabulated = tabulator()
+            tabulated.tabulate()
+            return tabulated
+
+        tabulated = self.record("tabulate", tabulate)
+        if tabulated is None:
+            tabulated = tabulate()
+
+        exceptions = os.path.join(self.directory, "exceptions")
+        os.makedirs(exceptions, exist_ok=True)
+        self.record("write_tabulation_count", lambda: tabulated.write_tabulation_count(
+            file=os.path.join(exceptions, "count.csv")))
+        self.record("write_tabulation_examples", lambda: tabulated.write_tabulation_examples(
+            file=os.path.join(exceptions, "incorrect-table.csv")))
+
+
+def regressions(results, baseline, tolerance):
+    """[(stage, scale, baseline wall, wall)] for stages more than
+    `tolerance` slower than in the baseline results."""
+    baseline_walls = {
+        (result["stage"], result["scale"]): result["wall_s"]
+        for result in baseline["results"]
+    }
+    return [
+        (result["stage"], result["scale"], baseline_walls[key], result["wall_s"])
+        for result in results
+        for key in [(result["stage"], result["scale"])]
+        if key in baseline_walls and result["wall_s"] > baseline_walls[key] * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES,
+                        help="corpus sizes, as multiples of data/adj.*")
+    parser.add_argument("--stages", type=str, nargs="+", choices=Bench.STAGES,
+                        help="only run these stages")
+    parser.add_argument("--grammar", type=str, default=None,
+                        help="grammar for the grammar stages (by default the big grammar)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the traced runs that measure peak memory")
+    parser.add_argument("--output", type=str, help="write JSON results here")
+    parser.add_argument("--baseline", type=str,
+                        help="JSON results to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown over the baseline to report, as a fraction")
+    parser.add_argument("--clean", action="store_true",
+                        help="regenerate the synthetic corpora")
+    args = parser.parse_args()
+
+    if args.clean and os.path.isdir(BENCH_DIR):
+        shutil.rmtree(BENCH_DIR)
+
+    results = []
+    for scale in args.scales:
+        results.extend(Bench(
+            scale, args.grammar, stages=args.stages, memory=not args.no_memory).run())
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.time(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for stage, scale, baseline_wall, wall in slower:
+            print("REGRESSION %s %dx: %.3f s -> %.3f s" % (
+                stage, scale, baseline_wall, wall), file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import re
+import pickle
+import hashlib
+from tabulate import GRAMMAR, FST
+
+CACHE = os.path.join(GRAMMAR, 'cache', 'cascade.pickle')
+# Bumped when the cached forms change shape.
+CACHE_VERSION = 2
+
+# Same shape of define statement that phonrule's readrules accepts.
+DEFINE = re.compile(r'\s*(defi?n?e?)\s+(\S+)\s+([^;]+)')
+
+
+def definitions(fomalines):
+    """Yield (name, definition) for each define statement, in order."""
+    for line in fomalines:
+        match = DEFINE.match(line.split(' #')[0])
+        if match:
+            _, name, definition = match.groups()
+            yield name, definition.strip()
+
+
+def references(definition, names):
+    """The subset of `names` referenced in `definition`, with or without a
+    leading % escape."""
+    return {
+        name for name in names
+        if re.search(r'(?<![\w%%])%%?%s(?!\w)' % re.escape(name), definition)
+    }
+
+
+def definition_hashes(fomalines):
+    """Yield (name, hash) for each define statement, in order. A name is
+    hashed by its definition and, recursively, by the definitions it
+    refers to at the point it's defined. Editing a feature class thus
+    changes the hash of every rule built on it."""
+    hashes = {}
+    for name, definition in definitions(fomalines):
+        digest = hashlib.sha1(definition.encode())
+        for dependency in sorted(references(definition, hashes)):
+            digest.update(('%s=%s' % (dependency, hashes[dependency])).encode())
+        hashes[name] = digest.hexdigest()
+        yield name, hashes[name]
+
+
+def rule_hashes(fomalines):
+    """{name: hash} of the last definition of each name."""
+    return dict(definition_hashes(fomalines))
+
+
+class IncrementalEvaluator:
+    """Push words through a ruleset's cascade one rule at a time, keeping
+    each word's intermediate forms after every rule. A rule with several
+    outputs for a form passes all of them on, so the outputs are those of
+    the composed cascade.
+
+    The cache is keyed by the (rule, hash) chain it was computed with. On
+    a later run, every word restarts from its cached form just before the
+    first rule whose position or definition changed, so an edit to one
+    rule only re-runs that rule and those after it.
+    """
+
+    def __init__(self, ruleset, fomalines, cache_file=CACHE):
+        self.ruleset = ruleset
+        self.cache_file = cache_file
+
+        hashes = rule_hashes(fomalines)
+        self.chain = [(rule, hashes.get(rule)) for rule in ruleset.rc]
+
+        cached_chain, self._forms = self.load()
+        self.restart_idx = self.common_prefix(cached_chain, self.chain)
+
+        # Words whose forms were computed under the current chain.
+        self._fresh = set()
+
+        # Stats for the most recent run.
+        self.transductions = 0
+        self.reused = 0
+
+    def load(self):
+        if self.cache_file and os.path.exists(self.cache_file):
+            with open(self.cache_file, 'rb') as f:
+                cache = pickle.load(f)
+            if cache.get('version') == CACHE_VERSION:
+                return cache['chain'], cache['forms']
+        return [], {}
+
+    def save(self):
+        if not self.cache_file:
+            return
+        # Forms of words that weren't recomputed are only valid up to the
+        # first changed rule.
+        self._forms = {
+            word: forms if word in self._fresh else forms[:self.restart_idx]
+            for word, forms in self._forms.items()
+        }
+
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'chain': self.chain, 'forms': self._forms}, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def resume_from(self, other):
+        """Start from another evaluator's forms instead of the disk cache,
+        e.g. to run a variant grammar over the same words. Only forms the
+        other evaluator computed under its own chain are taken."""
+        self._forms = {
+            word: forms for word, forms in other._forms.items()
+            if word in other._fresh
+        }
+        self._fresh = set()
+        self.restart_idx = self.common_prefix(other.chain, self.chain)
+
+    @staticmethod
+    def common_prefix(old_chain, new_chain):
+        idx = 0
+        for old, new in zip(old_chain, new_chain):
+            if old != new or new[1] is None:
+                break
+            idx += 1
+        return idx
+
+    def forms(self, word):
+        """Return the word's forms after each rule in the cascade, as a
+        tuple per rule."""
+        cached = self._forms.get(word)
+        if word in self._fresh:
+            return cached
+
+        if cached is not None:
+            forms = cached[:self.restart_idx]
+            self.reused += len(forms)
+        else:
+            forms = []
+
+        prev = forms[-1] if forms else (word,)
+        for rule, _ in self.chain[len(forms):]:
+            self.transductions += len(prev)
+            prev = tuple(FST.decode(form) for form in self.ruleset.transduce_forms(
+                rule, [form.encode() for form in prev]))
+            forms.append(prev)
+
+        self._forms[word] = forms
+        self._fresh.add(word)
+        return forms
+
+    def outputs(self, word):
+        forms = self.forms(word)
+        return forms[-1] if forms else (word,)
+
+    def applicable_rules(self, word):
+        """The rules that changed the word's forms, in cascade order."""
+        applicable_rules = []
+        prev = (word,)
+        for (rule, _), form in zip(self.chain, self.forms(word)):
+            if form != prev:
+                applicable_rules.append(rule)
+            prev = form
+        return applicable_rules
+
+    def run(self, words):
+        """Compute forms for all words, then persist the cache under the
+        current chain."""
+        self.transductions = self.reused = 0
+        results = {word: self.forms(word) for word in words}
+        self.save()
+        return results
@@ -0,0 +1,284 @@
+import numpy as np
+from snapshot import Interner
+from corpus import OrthBank, PhonBank
+
+
+# Final segment decontinuation in UR derivation, as in Corpus.get_ur_to_infl.
+DECONT = {
+    "ɣ": "ɡ",
+    "ð": "d",
+    "β": "b"
+}
+
+FRONT = b"ea"
+BACK = b"ou"
+
+
+def encode_strings(strings):
+    """(UTF-8 data, offsets) for a list of strings."""
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def gather(offsets, rows, lengths=None):
+    """Flat indices of the elements of `rows` in a ragged array with the
+    given offsets, and the offsets of the gathered rows."""
+    starts = offsets[rows].astype(np.int64)
+    if lengths is None:
+        lengths = offsets[rows + 1].astype(np.int64) - starts
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = np.arange(new_offsets[-1]) + np.repeat(starts - new_offsets[:-1], lengths)
+    return positions, new_offsets
+
+
+class Columns:
+    """Columnar image of the orth and phon banks.
+
+    Strings (inflections, lemmas, keys) live in one UTF-8 buffer with
+    offsets, and rows refer to them by id. Phonemes, multichar symbols
+    included, are interned to small ints, and phonetic forms are runs of
+    phoneme ids in one flat buffer with row offsets. Built on a snapshot,
+    the columns are views of its mapped sections rather than copies.
+
+    derive_urs() applies Corpus's UR heuristics to the whole corpus at once
+    on these arrays; ur_to_infl() and lemma_to_phon_infl() render the
+    results as the dicts Corpus builds.
+    """
+
+    def __init__(self, phonemes, string_data, string_offsets,
+                 lemma_ids, key_ids, phon_ids, phon_offsets):
+        self.phonemes = list(phonemes)
+        self.string_data = string_data
+        self.string_offsets = string_offsets
+        self.lemma_ids = lemma_ids
+        self.key_ids = key_ids
+        self.phon_ids = phon_ids
+        self.phon_offsets = phon_offsets
+
+        self._key_ids = None
+        self._urs = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        def view(section, dtype):
+            return np.frombuffer(section, dtype=dtype)
+
+        return cls(
+            snapshot.phoneme_table,
+            view(snapshot.string_data, np.uint8),
+            view(snapshot.string_offsets, np.uint32),
+            view(snapshot.lemma_ids, np.uint32),
+            view(snapshot.key_ids, np.uint32),
+            view(snapshot.phon_ids, np.uint16),
+            view(snapshot.phon_offsets, np.uint32))
+
+    @classmethod
+    def from_rows(cls, orth_rows, phon_rows):
+        """Build the columns in one pass over orth rows (dicts) and phon
+        rows (lists of segments), e.g. straight from the corpus files."""
+        strings = Interner()
+        phonemes = Interner()
+
+        lemma_ids, key_ids, phon_ids, phon_offsets = [], [], [], [0]
+        for row, segments in zip(orth_rows, phon_rows):
+            lemma_ids.append(strings(row[OrthBank.LEMMA]))
+            key_ids.append(strings(row[OrthBank.KEY]))
+            phon_ids.extend(phonemes(segment) for segment in segments)
+            phon_offsets.append(len(phon_ids))
+
+        string_data, string_offsets = encode_strings(strings.strings)
+        return cls(
+            phonemes.strings,
+            string_data,
+            string_offsets,
+            np.array(lemma_ids, dtype=np.uint32),
+            np.array(key_ids, dtype=np.uint32),
+            np.array(phon_ids, dtype=np.uint16),
+            np.array(phon_offsets, dtype=np.uint32))
+
+    def __len__(self):
+        return len(self.lemma_ids)
+
+    def string(self, idx):
+        start, end = self.string_offsets[idx], self.string_offsets[idx + 1]
+        return self.string_data[start:end].tobytes().decode()
+
+    def keys(self):
+        """{inflection key: string id}. Only the few distinct keys are
+        decoded."""
+        if self._key_ids is None:
+            self._key_ids = {
+                self.string(idx): idx for idx in np.unique(self.key_ids).tolist()}
+        return self._key_ids
+
+    def key_id(self, key):
+        """The string id of an inflection key, or -1 if it doesn't occur."""
+        return self.keys().get(key, -1)
+
+    def final_bytes(self, string_ids):
+        """The last byte of each string. Enough to test for a final ASCII
+        character, since no byte of a multibyte UTF-8 character is ASCII."""
+        return self.string_data[self.string_offsets[string_ids + 1].astype(np.int64) - 1]
+
+    def lemma_keys(self):
+        """For every (lemma, key) pair among rows whose key isn't ignored:
+        its lemma id, key id, and first and last row, ordered by first row.
+        As in Corpus, a later row for the same pair overrides earlier ones."""
+        ignored = [self.key_id(key) for key in OrthBank.IGNORE]
+        rows = np.flatnonzero(~np.isin(self.key_ids, ignored))
+
+        n_strings = len(self.string_offsets) - 1
+        pairs = self.lemma_ids[rows].astype(np.int64) * n_strings + self.key_ids[rows]
+
+        unique_pairs, first = np.unique(pairs, return_index=True)
+        _, last_reversed = np.unique(pairs[::-1], return_index=True)
+        last = len(pairs) - 1 - last_reversed
+
+        order = np.argsort(rows[first], kind="stable")
+        return (
+            (unique_pairs // n_strings)[order],
+            (unique_pairs % n_strings)[order],
+            rows[first][order],
+            rows[last][order])
+
+    def lemmas(self):
+        """Lemmas with both a masc and fem sing inflection, in order of their
+        first row, with the last row of each of the two."""
+        lemma_ids, key_ids, first_rows, last_rows = self.lemma_keys()
+
+        lemmas, first_pair = np.unique(lemma_ids, return_index=True)
+        index = np.searchsorted(lemmas, lemma_ids)
+
+        ms_rows = np.full(len(lemmas), -1, dtype=np.int64)
+        fs_rows = np.full(len(lemmas), -1, dtype=np.int64)
+        ms = key_ids == self.key_id(OrthBank.MS)
+        fs = key_ids == self.key_id(OrthBank.FS)
+        ms_rows[index[ms]] = last_rows[ms]
+        fs_rows[index[fs]] = last_rows[fs]
+
+        keep = (ms_rows >= 0) & (fs_rows >= 0)
+        # Pairs are ordered by first row, so a lemma's first pair is its
+        # first row.
+        order = np.argsort(first_pair[keep], kind="stable")
+        return lemmas[keep][order], ms_rows[keep][order], fs_rows[keep][order]
+
+    def phoneme_tables(self):
+        """Lookup tables over phoneme ids, extending the phoneme table with
+        any segments they produce:
+
+            chop: the segment minus its last character, or -1 if that
+                  leaves nothing
+            decont: the segment with a final continuant decontinuated
+        """
+        phonemes = Interner()
+        for phoneme in self.phonemes:
+            phonemes(phoneme)
+
+        chop = np.array([
+            phonemes(phoneme[:-1]) if len(phoneme) > 1 else -1
+            for phoneme in self.phonemes], dtype=np.int64)
+
+        decont = np.arange(len(phonemes), dtype=np.int64)
+        for idx, phoneme in enumerate(list(phonemes.strings)):
+            if phoneme and phoneme[-1] in DECONT:
+                decont[idx] = phonemes(phoneme[:-1] + DECONT[phoneme[-1]])
+        decont = np.concatenate([decont, np.arange(len(decont), len(phonemes))])
+
+        return phonemes.strings, chop, decont
+
+    def derive_urs(self):
+        """Derive a UR for each lemma as Corpus.get_ur_to_infl does, over the
+        whole corpus at once:
+
+            - lemma-final e/a: the fem sing inflection
+            - lemma-final o/u: the masc sing inflection
+            - otherwise the fem sing minus its final character, with the new
+              final segment decontinuated and the last syllable marker
+              dropped
+
+        Returns (lemma ids, UR phoneme ids, UR offsets), the latter against
+        self.ur_phonemes."""
+        if self._urs is not None:
+            return self._urs
+
+        lemmas, ms_rows, fs_rows = self.lemmas()
+        final = self.final_bytes(lemmas)
+        back = np.isin(final, np.frombuffer(BACK, dtype=np.uint8))
+        chopped = ~back & ~np.isin(final, np.frombuffer(FRONT, dtype=np.uint8))
+
+        positions, offsets = gather(self.phon_offsets, np.where(back, ms_rows, fs_rows))
+        self.ur_phonemes, chop, decont = self.phoneme_tables()
+        ids = self.phon_ids[positions].astype(np.int64)
+        keep = np.ones(len(ids), dtype=bool)
+
+        # The final character: a single character segment goes entirely,
+        # a multichar one loses its last character.
+        last = offsets[1:][chopped] - 1
+        chopped_ids = chop[ids[last]]
+        whole = chopped_ids < 0
+        keep[last[whole]] = False
+        ids[last[~whole]] = chopped_ids[~whole]
+
+        new_last = np.where(whole, last - 1, last)
+        ids[new_last] = decont[ids[new_last]]
+
+        # Drop the last syllable marker left in the row.
+        syll = self.ur_phonemes.index(PhonBank.SYLL) if PhonBank.SYLL in self.ur_phonemes else -1
+        marked = np.where((ids == syll) & keep, np.arange(len(ids)), -1)
+        starts = offsets[:-1][chopped]
+        last_syll = np.maximum.reduceat(marked, offsets[:-1])[chopped] if len(ids) else marked
+        dropped = last_syll >= starts
+        keep[last_syll[dropped]] = False
+
+        row_lengths = np.add.reduceat(keep.astype(np.int64), offsets[:-1]) if len(ids) else np.zeros(0, dtype=np.int64)
+        ur_offsets = np.zeros(len(lemmas) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=ur_offsets[1:])
+
+        self._urs = lemmas, ids[keep], ur_offsets
+        return self._urs
+
+    @staticmethod
+    def forms(phonemes, ids, offsets):
+        """Render a ragged array of phoneme ids as strings."""
+        ids, offsets = ids.tolist(), offsets.tolist()
+        return [
+            "".join([phonemes[phon_id] for phon_id in ids[start:end]])
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def row_forms(self, rows):
+        positions, offsets = gather(self.phon_offsets, rows)
+        return self.forms(self.phonemes, self.phon_ids[positions], offsets)
+
+    def ur_forms(self):
+        """[(lemma id, UR)] in derivation order."""
+        lemmas, ids, offsets = self.derive_urs()
+        return list(zip(lemmas.tolist(), self.forms(self.ur_phonemes, ids, offsets)))
+
+    def infl_maps(self, lemmas):
+        """{lemma id: {key: inflection}} for the given lemmas, keys in order
+        of their first row."""
+        lemma_ids, key_ids, _, last_rows = self.lemma_keys()
+        wanted = np.isin(lemma_ids, lemmas)
+
+        keys = {idx: key for key, idx in self.keys().items()}
+
+        infl_maps = {}
+        for lemma, key, form in zip(
+                lemma_ids[wanted].tolist(), key_ids[wanted].tolist(),
+                self.row_forms(last_rows[wanted])):
+            infl_maps.setdefault(lemma, {})[keys[key]] = form
+        return infl_maps
+
+    def lemma_to_phon_infl(self):
+        lemmas, _, _ = self.lemmas()
+        infl_maps = self.infl_maps(lemmas)
+        return {self.string(lemma): infl_maps[lemma] for lemma in lemmas.tolist()}
+
+    def ur_to_infl(self):
+        lemmas, _, _ = self.derive_urs()
+        infl_maps = self.infl_maps(lemmas)
+        return {ur: infl_maps[lemma] for lemma, ur in self.ur_forms()}
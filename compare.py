@@ -0,0 +1,124 @@
+import sys
+import lexc
+from tabulate import (
+    UR_LEXICON,
+    SR_LEXICON,
+    Tabulator,
+    read_ruleset,
+)
+from evaluation import Evaluation
+from cascade import IncrementalEvaluator
+
+
+CORRECT = Tabulator.CORRECT
+INCORRECT = Tabulator.INCORRECT
+
+
+def read_grammar_lines(grammar_file_name):
+    with open(grammar_file_name) as grammar_file:
+        return [line.rstrip() for line in grammar_file]
+
+
+class Comparison:
+    """Evaluate two grammars against the same lexicons in one process.
+
+    The lexicons are parsed once, and the new grammar's cascade picks up
+    every word from the old one's intermediate forms at the first rule
+    whose position or definition differs, so only the rules from there on
+    run twice.
+    """
+
+    def __init__(self, old_grammar, new_grammar, ur_pairs, sr_pairs):
+        self.old_grammar = old_grammar
+        self.new_grammar = new_grammar
+
+        old_ruleset = read_ruleset(old_grammar)
+        new_ruleset = read_ruleset(new_grammar)
+
+        old_evaluator = IncrementalEvaluator(
+            old_ruleset, read_grammar_lines(old_grammar), cache_file=None)
+        self.old = self.tabulate(old_grammar, old_ruleset, old_evaluator, ur_pairs, sr_pairs)
+
+        new_evaluator = IncrementalEvaluator(
+            new_ruleset, read_grammar_lines(new_grammar), cache_file=None)
+        new_evaluator.resume_from(old_evaluator)
+        self.new = self.tabulate(new_grammar, new_ruleset, new_evaluator, ur_pairs, sr_pairs)
+
+        self.shared_rules = new_evaluator.restart_idx
+        self.transductions = old_evaluator.transductions + new_evaluator.transductions
+        self.reused = new_evaluator.reused
+
+    @classmethod
+    def from_files(cls, old_grammar, new_grammar, ur_lexicon=UR_LEXICON, sr_lexicon=SR_LEXICON):
+        return cls(old_grammar, new_grammar,
+                   lexc.read_pairs(ur_lexicon), lexc.read_pairs(sr_lexicon))
+
+    @staticmethod
+    def tabulate(grammar_file_name, ruleset, evaluator, ur_pairs, sr_pairs):
+        evaluation = Evaluation(ruleset, ur_pairs, sr_pairs, evaluator=evaluator)
+        tabulator = Tabulator(
+            grammar_file_name=grammar_file_name,
+            predictions=evaluation.prediction_dicts,
+            ruleset=ruleset)
+        tabulator.tabulate(evaluator=evaluator)
+        return tabulator
+
+    @staticmethod
+    def outcomes(tabulator):
+        """UR -> (prediction type, predicted SR, rule signature)."""
+        return {
+            ur: (prediction_type, prediction[Tabulator.SR], prediction[Tabulator.RULES])
+            for prediction_type, predictions in tabulator.prediction_dicts_map.items()
+            for ur, prediction in predictions.items()
+        }
+
+    def changed(self):
+        """[(UR, old outcome, new outcome)] for URs whose predicted SR or
+        rule signature differs, sorted by UR. An outcome is None if the
+        grammar made no prediction for the UR."""
+        old = self.outcomes(self.old)
+        new = self.outcomes(self.new)
+        return [
+            (ur, old.get(ur), new.get(ur))
+            for ur in sorted(old.keys() | new.keys())
+            if old.get(ur) != new.get(ur)
+        ]
+
+    def signature_deltas(self):
+        """[(signature, correct delta, incorrect delta)] for every signature
+        whose counts changed, sorted by signature."""
+        old = self.old.rule_application_count()
+        new = self.new.rule_application_count()
+
+        deltas = []
+        for signature in sorted(old.keys() | new.keys()):
+            old_row = old.get(signature, {})
+            new_row = new.get(signature, {})
+            delta = tuple(
+                new_row.get(prediction_type, 0) - old_row.get(prediction_type, 0)
+                for prediction_type in (CORRECT, INCORRECT)
+            )
+            if any(delta):
+                deltas.append((signature,) + delta)
+        return deltas
+
+    def write(self, file=sys.stdout):
+        def columns(outcome):
+            return list(outcome) if outcome else ['', '', '']
+
+        print('UR\tOLD\tOLD SR\tOLD RULES\tNEW\tNEW SR\tNEW RULES', file=file)
+        for ur, old, new in self.changed():
+            print('\t'.join([ur] + columns(old) + columns(new)), file=file)
+
+        print('', file=file)
+        print('%s\t%s\t%s' % (Tabulator.RULES, CORRECT, INCORRECT), file=file)
+        for signature, correct, incorrect in self.signature_deltas():
+            print('%s\t%+d\t%+d' % (signature, correct, incorrect), file=file)
+
+        print('', file=file)
+        print('%s: %d correct, %d incorrect' % (
+            self.old_grammar, len(self.old.correct_predictions),
+            len(self.old.incorrect_predictions)), file=file)
+        print('%s: %d correct, %d incorrect' % (
+            self.new_grammar, len(self.new.correct_predictions),
+            len(self.new.incorrect_predictions)), file=file)
@@ -1,12 +1,18 @@
 import os
 import re
 import csv
-import panphon
-from lib.epi import ConfigurableEpitran
+import sys
+import itertools
+from snapshot import Snapshot
+from timings import timed, report
 from collections import defaultdict
 from pprint import pprint
 import argparse
 
+# panphon, epitran and numpy (via features) are slow to import and only
+# needed for feature definitions and transliteration, so they're imported
+# on first use.
+
 
 DATA_DIR = "data"
 
@@ -28,6 +34,25 @@ class RowIterable:
         return self.rows.__len__()
 
 
+class StreamingRows:
+    """Re-iterable rows that are read afresh from their source on every
+    pass, rather than held in memory. len() takes a pass; indexing isn't
+    supported."""
+
+    def __init__(self, read_rows):
+        self.read_rows = read_rows
+
+    def __iter__(self):
+        return iter(self.read_rows())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, idx):
+        raise TypeError("Streamed rows can't be indexed; iterate over them, "
+                        "or load the corpus without --stream")
+
+
 class OrthBank(RowIterable):
     FILE = "adj.orth"
     PATH = os.path.join(DATA_DIR, FILE)
@@ -58,11 +83,21 @@ class OrthBank(RowIterable):
     KEY = "key"
     LEMMA = "lemma"
 
-    def __init__(self):
-        self.rows = list(csv.DictReader(
-            open(self.PATH), delimiter=" ", fieldnames=[
-                OrthBank.INFL, OrthBank.LEMMA, OrthBank.KEY]
-        ))
+    FIELDNAMES = [INFL, LEMMA, KEY]
+
+    def __init__(self, snapshot=None, streaming=False):
+        if snapshot is not None:
+            self.rows = snapshot.orth_rows(self.FIELDNAMES)
+        elif streaming:
+            self.rows = StreamingRows(self.read_rows)
+        else:
+            self.rows = list(self.read_rows())
+
+    @classmethod
+    def read_rows(cls):
+        with open(cls.PATH) as f:
+            yield from csv.DictReader(
+                f, delimiter=" ", fieldnames=cls.FIELDNAMES)
 
 
 class PhonBank(RowIterable):
@@ -97,34 +132,59 @@ class PhonBank(RowIterable):
     SYLL = "-"
     STRESS = "1"
 
-    def __init__(self, incl_stress=True, incl_syllables=True):
-        def preproc(row):
-            row = row.split()
-
-            if not incl_stress:
-                row = map(lambda seg: seg.replace("1", ""), row)
-            if not incl_syllables:
-                row = map(lambda seg: seg.replace("-", ""), row)
-
-            if incl_stress and incl_syllables:
-                # Then let's move the stress to the beginning of its syllable.
-                last_syl_marker_idx = -1
-                for idx, unit in enumerate(row[:]):
-                    last_syl_marker_idx = idx if unit == self.SYLL else last_syl_marker_idx
-                    if self.STRESS in unit:
-                        row[idx] = unit.replace(self.STRESS, "")
-                        row.insert(last_syl_marker_idx + 1, self.STRESS)
-
-            return " ".join([
-                self.ipa_map[segment] if segment in self.ipa_map else segment
-                for segment in row
-            ])
-
-        raw_rows = open(self.PATH).readlines()
-        self.rows = [preproc(row) for row in raw_rows]
-
-        self._phonemes = self.get_phonemes()
-        self.feature_table = panphon.FeatureTable()
+    def __init__(self, incl_stress=True, incl_syllables=True, snapshot=None, streaming=False):
+        self.incl_stress = incl_stress
+        self.incl_syllables = incl_syllables
+
+        if snapshot is not None:
+            self.rows = snapshot.phon_rows()
+            self._phonemes = snapshot.phonemes
+        elif streaming:
+            self.rows = StreamingRows(self.read_rows)
+            self._phonemes = None
+        else:
+            self.rows = list(self.read_rows())
+            self._phonemes = self.get_phonemes()
+
+        self._feature_table = None
+        self._feature_matrix = None
+
+    def read_rows(self):
+        return (" ".join(segments) for segments in self.read_segments(
+            self.incl_stress, self.incl_syllables))
+
+    @classmethod
+    def read_segments(cls, incl_stress, incl_syllables):
+        with open(cls.PATH) as f:
+            for row in f:
+                yield cls.preproc_segments(row, incl_stress, incl_syllables)
+
+    def preproc(self, row):
+        return " ".join(
+            self.preproc_segments(row, self.incl_stress, self.incl_syllables))
+
+    @classmethod
+    def preproc_segments(cls, row, incl_stress, incl_syllables):
+        row = row.split()
+
+        if not incl_stress:
+            row = map(lambda seg: seg.replace("1", ""), row)
+        if not incl_syllables:
+            row = map(lambda seg: seg.replace("-", ""), row)
+
+        if incl_stress and incl_syllables:
+            # Then let's move the stress to the beginning of its syllable.
+            last_syl_marker_idx = -1
+            for idx, unit in enumerate(row[:]):
+                last_syl_marker_idx = idx if unit == cls.SYLL else last_syl_marker_idx
+                if cls.STRESS in unit:
+                    row[idx] = unit.replace(cls.STRESS, "")
+                    row.insert(last_syl_marker_idx + 1, cls.STRESS)
+
+        return [
+            cls.ipa_map[segment] if segment in cls.ipa_map else segment
+            for segment in row
+        ]
 
     def __getitem__(self, idx):
         return self.rows[idx]
@@ -138,41 +198,55 @@ class PhonBank(RowIterable):
 
     @property
     def phonemes(self):
+        if self._phonemes is None:
+            self._phonemes = self.get_phonemes()
         return self._phonemes
 
     @property
-    def features(self):
-        return self.feature_phoneme_sets.keys()
+    def feature_table(self):
+        if self._feature_table is None:
+            with timed("import panphon"):
+                import panphon
+            with timed("FeatureTable"):
+                self._feature_table = panphon.FeatureTable()
+        return self._feature_table
 
     @property
-    def phoneme_feature_sets(self):
-
-        def fs(phon):
-            fts = self.feature_table.word_fts(phon)
-
-            if len(fts) != 1:
-                return
-
-            else:
-                segment = fts[0]
+    def feature_matrix(self):
+        """Phoneme × feature matrix, computed once on first access."""
+        if self._feature_matrix is None:
+            with timed("import features"):
+                from features import FeatureMatrix
+            feature_table = self.feature_table
+            with timed("FeatureMatrix"):
+                self._feature_matrix = FeatureMatrix.from_feature_table(
+                    self.phonemes, feature_table)
+        return self._feature_matrix
 
-            def markup(feat):
-                return "%s%s" % ("+" if segment[feat] == 1 else "-", feat)
+    @property
+    def tokenizer(self):
+        """Longest-match segmenter over this bank's phonemes, for splitting
+        joined forms back into segments."""
+        if getattr(self, "_tokenizer", None) is None:
+            from segments import Tokenizer
+            self._tokenizer = Tokenizer.from_phonemes(self.phonemes)
+        return self._tokenizer
+
+    def natural_class(self, query):
+        """Phonemes matching a feature expression like "+son & -nas"."""
+        return self.feature_matrix.natural_class(query)
 
-            # Only those features that are defined for the phoneme.
-            return [markup(feat) for feat in segment
-                    if segment[feat] in [-1, 1]]
+    @property
+    def features(self):
+        return self.feature_phoneme_sets.keys()
 
-        return {phon: fs(phon) for phon in self.phonemes if fs(phon)}
+    @property
+    def phoneme_feature_sets(self):
+        return self.feature_matrix.phoneme_feature_sets()
 
     @property
     def feature_phoneme_sets(self):
-        features = defaultdict(set)
-        for phon, fs in self.phoneme_feature_sets.items():
-            for feature in fs:
-                features[feature].add(phon)
-
-        return features
+        return self.feature_matrix.feature_phoneme_sets()
 
 
 class Corpus(RowIterable):
@@ -184,25 +258,128 @@ class Corpus(RowIterable):
     PL = "+Pl"
     ADJ_INF = "AdjInf"
 
-    def __init__(self, preserve_syllables, preserve_stress):
-        self.phon_bank = PhonBank(
-            incl_syllables=preserve_syllables, incl_stress=preserve_stress)
-        self.orth_bank = OrthBank()
+    SNAPSHOT = "adj"
 
-        self.lemma_to_phon_infl = self.get_lemma_to_phon_infl()
-        self.ur_to_infl = self.get_ur_to_infl()
+    def __init__(self, preserve_syllables, preserve_stress, use_snapshot=True, streaming=False,
+                 columnar=False):
+        self.streaming = streaming
+
+        self.snapshot = None
+        if use_snapshot and not streaming:
+            with timed("Snapshot"):
+                self.snapshot = self.load_snapshot(preserve_syllables, preserve_stress)
+
+        with timed("PhonBank"):
+            self.phon_bank = PhonBank(
+                incl_syllables=preserve_syllables, incl_stress=preserve_stress,
+                snapshot=self.snapshot, streaming=streaming)
+        with timed("OrthBank"):
+            self.orth_bank = OrthBank(snapshot=self.snapshot, streaming=streaming)
 
+        # With columnar, URs are derived on the interned columns, and
+        # lemma_to_phon_infl is only rendered if asked for.
+        self.columns = None
+        self._lemma_to_phon_infl = None
+        if columnar:
+            with timed("Columns"):
+                self.columns = self.load_columns(preserve_syllables, preserve_stress)
+        else:
+            with timed("lemma_to_phon_infl"):
+                self._lemma_to_phon_infl = self.get_lemma_to_phon_infl()
+
+        with timed("ur_to_infl"):
+            self.ur_to_infl = self.get_ur_to_infl()
+
+        self._epi = None
+
+    @property
+    def epi(self):
         # Epitran applies some of its own rules unless instructed not to,
         # depriving us of the opportunity, unless we unset this preproc flag.
         # See https://github.com/dmort27/epitran/blob/master/epitran/data/pre/cat-Latn.txt
-        file = "cat-Latn.csv"
-        g2p_loc = os.path.join("..", DATA_DIR, "map", file)
-        self.epi = ConfigurableEpitran("cat-Latn", preproc=False, g2p_loc=g2p_loc)
+        if getattr(self, "_epi", None) is None:
+            with timed("import epitran"):
+                from lib.epi import ConfigurableEpitran
+            with timed("ConfigurableEpitran"):
+                file = "cat-Latn.csv"
+                g2p_loc = os.path.join("..", DATA_DIR, "map", file)
+                self._epi = ConfigurableEpitran("cat-Latn", preproc=False, g2p_loc=g2p_loc)
+        return self._epi
+
+    @classmethod
+    def load_snapshot(cls, preserve_syllables, preserve_stress):
+        """Load (or build, if the corpus files or flags changed) the binary
+        snapshot of the orth and phon banks."""
+        def build_rows():
+            return (
+                OrthBank.read_rows(),
+                PhonBank.read_segments(preserve_stress, preserve_syllables))
+
+        name = "%s.syll%d.stress%d" % (
+            cls.SNAPSHOT, preserve_syllables, preserve_stress)
+
+        return Snapshot.load_or_build(
+            name,
+            sources=[OrthBank.PATH, PhonBank.PATH],
+            flags=(preserve_syllables, preserve_stress),
+            build_rows=build_rows,
+            fieldnames=OrthBank.FIELDNAMES)
+
+    def load_columns(self, preserve_syllables, preserve_stress):
+        from columns import Columns
+        if self.snapshot is not None:
+            return Columns.from_snapshot(self.snapshot)
+        return Columns.from_rows(
+            OrthBank.read_rows(),
+            PhonBank.read_segments(preserve_stress, preserve_syllables))
+
+    @property
+    def lemma_to_phon_infl(self):
+        if getattr(self, "_lemma_to_phon_infl", None) is None:
+            self._lemma_to_phon_infl = self.get_lemma_to_phon_infl()
+        return self._lemma_to_phon_infl
+
+    def segments(self, form):
+        """Split a joined form, e.g. a UR or SR, into its segments."""
+        return self.phon_bank.tokenizer(form)
 
     def orth_to_phon(self, orth):
         return self.epi.transliterate(orth)
 
+    def stream_phon_infls(self):
+        """Yield (lemma, key, phonetic inflection) triples by zipping the orth
+        and phon files line by line. Ignored keys are dropped before their
+        phonetic row is preprocessed."""
+        incl_stress = self.phon_bank.incl_stress
+        incl_syllables = self.phon_bank.incl_syllables
+
+        with open(PhonBank.PATH) as phon_f:
+            for line, (row, phon_row) in enumerate(
+                    itertools.zip_longest(OrthBank.read_rows(), phon_f), 1):
+                if row is None or phon_row is None:
+                    raise ValueError("%s and %s differ in length at line %d" % (
+                        OrthBank.PATH, PhonBank.PATH, line))
+
+                key = row[OrthBank.KEY]
+                if key in OrthBank.IGNORE: continue
+
+                segments = PhonBank.preproc_segments(
+                    phon_row, incl_stress, incl_syllables)
+                yield row[OrthBank.LEMMA], key, "".join(segments)
+
     def get_lemma_to_phon_infl(self):
+        if self.columns is not None:
+            return self.columns.lemma_to_phon_infl()
+
+        if self.snapshot is not None:
+            return self.get_lemma_to_phon_infl_from_snapshot()
+
+        if self.streaming:
+            lemma_to_phon_infl = defaultdict(dict)
+            for lemma, key, phonetic_infl in self.stream_phon_infls():
+                lemma_to_phon_infl[lemma][key] = phonetic_infl
+            return self.filter_lemma_to_phon_infl(lemma_to_phon_infl)
+
         lemma_to_phon_infl = defaultdict(dict)
 
         for idx, row in enumerate(self.orth_bank):
@@ -217,15 +394,39 @@ class Corpus(RowIterable):
 
             lemma_to_phon_infl[lemma][key] = phonetic_infl
 
+        return self.filter_lemma_to_phon_infl(lemma_to_phon_infl)
+
+    def get_lemma_to_phon_infl_from_snapshot(self):
+        """As get_lemma_to_phon_infl, but working on the snapshot's interned
+        columns rather than materialized rows."""
+        snapshot = self.snapshot
+        string = snapshot.string
+
+        ignored = {
+            key_id for key_id in set(snapshot.key_ids)
+            if string(key_id) in OrthBank.IGNORE}
+
+        lemma_to_phon_infl = defaultdict(dict)
+
+        for idx, (lemma_id, key_id) in enumerate(
+                zip(snapshot.lemma_ids, snapshot.key_ids)):
+            if key_id in ignored: continue
+
+            lemma_to_phon_infl[string(lemma_id)][string(key_id)] = "".join(
+                snapshot.segments(idx))
+
+        return self.filter_lemma_to_phon_infl(lemma_to_phon_infl)
+
+    @staticmethod
+    def filter_lemma_to_phon_infl(lemma_to_phon_infl):
         # filter examples that lack both MS and FS
-        lemma_to_phon_infl = {
+        return {
             lemma: infls for lemma, infls in lemma_to_phon_infl.items()
             if OrthBank.MS in infls and OrthBank.FS in infls}
 
-        return lemma_to_phon_infl
-
     def get_ur_to_infl(self):
-        """Derive underlying representations with some heuristics:
+        """Derive underlying representations with some heuristics (on the
+        columns, if any; see Columns.derive_urs):
 
             - Assume UR is fem sing minus final phon, plus
               decontinuation of word final stops:
@@ -269,13 +470,15 @@ class Corpus(RowIterable):
 
             return ur
 
+        if self.columns is not None:
+            return self.columns.ur_to_infl()
+
         return {
             to_ur(infl_map, lemma): infl_map
             for lemma, infl_map in self.lemma_to_phon_infl.items()
             if OrthBank.FS in infl_map}
 
-    def format_UR_lexicon(self):
-        root_templ = """
+    UR_LEXICON_HEAD = """
 Multichar_Symbols {MASC} {FEM} d͡ʒ t͡ʃ
 
 LEXICON Root
@@ -284,57 +487,81 @@ Adj ;
 
 LEXICON Adj
 
-{UR}
+"""
 
+    UR_LEXICON_TAIL = """
 LEXICON {ADJ_INF}
 
 {MASC}:0   #;
 {FEM}:ə    #;
 """
 
-        return root_templ.format(
-            UR=self.format_UR(),
-            MASC=self.MASC,
-            FEM=self.FEM,
-            ADJ_INF=self.ADJ_INF
-        )
-
-    def format_SR_lexicon(self):
-        root_templ = """
+    SR_LEXICON_HEAD = """
 Multichar_Symbols {MASC} {FEM} d͡ʒ t͡ʃ
 
 LEXICON SR
 
-{UR_to_SR}
 """
-        return root_templ.format(
-            UR_to_SR=self.format_UR_to_SR(),
-            MASC=self.MASC,
-            FEM=self.FEM,
-        )
 
-    def format_UR_to_SR(self):
+    def _template_lines(self, templ):
+        return templ.format(
+            MASC=self.MASC, FEM=self.FEM, ADJ_INF=self.ADJ_INF
+        ).splitlines(keepends=True)
+
+    def iter_UR_lexicon(self, urs=None):
+        """Yield the UR lexicon line by line, for `urs` or all of them. The
+        lines can be written out as they come or fed straight to
+        lexc.pairs."""
+        yield from self._template_lines(self.UR_LEXICON_HEAD)
+        for line in self.iter_UR(urs):
+            yield line + "\n"
+        yield from self._template_lines(self.UR_LEXICON_TAIL)
+
+    def iter_SR_lexicon(self, urs=None):
+        yield from self._template_lines(self.SR_LEXICON_HEAD)
+        for line in self.iter_UR_to_SR(urs):
+            yield line + "\n"
+
+    def write_UR_lexicon(self, f, urs=None):
+        f.writelines(self.iter_UR_lexicon(urs))
+
+    def write_SR_lexicon(self, f, urs=None):
+        f.writelines(self.iter_SR_lexicon(urs))
+
+    def write_lexicon_shards(self, iter_lexicon, paths):
+        """Write one complete lexicon per path, the URs dealt out among them
+        round robin, so that each shard compiles on its own."""
+        for idx, path in enumerate(paths):
+            urs = itertools.islice(self.ur_to_infl.keys(), idx, None, len(paths))
+            with open(path, "w") as f:
+                f.writelines(iter_lexicon(urs))
+
+    def format_UR_lexicon(self):
+        return "".join(self.iter_UR_lexicon())
+
+    def format_SR_lexicon(self):
+        return "".join(self.iter_SR_lexicon())
+
+    def iter_UR_to_SR(self, urs=None):
         templates = {
             OrthBank.MS: "{{ur}}{MASC}:{{sr}}\t#;".format(MASC=self.MASC),
             OrthBank.FS: "{{ur}}{FEM}:{{sr}}\t#;".format(FEM=self.FEM)}
 
-        return "\n".join([
-            templates[infl_key].format(
-                ur=ur,
-                sr=infl_val
-            )
-            for ur, infl_map in self.ur_to_infl.items()
-            for infl_key, infl_val in infl_map.items()
-            if infl_key in templates])
+        for ur in self.ur_to_infl.keys() if urs is None else urs:
+            for infl_key, infl_val in self.ur_to_infl[ur].items():
+                if infl_key in templates:
+                    yield templates[infl_key].format(ur=ur, sr=infl_val)
 
-    def format_UR(self):
+    def format_UR_to_SR(self):
+        return "\n".join(self.iter_UR_to_SR())
+
+    def iter_UR(self, urs=None):
         templ = "{ur} {ADJ_INF};"
-        return "\n".join([
-            templ.format(
-                ur=ur,
-                ADJ_INF=self.ADJ_INF)
-            for ur in self.ur_to_infl.keys()
-        ])
+        for ur in self.ur_to_infl.keys() if urs is None else urs:
+            yield templ.format(ur=ur, ADJ_INF=self.ADJ_INF)
+
+    def format_UR(self):
+        return "\n".join(self.iter_UR())
 
     def format_phonetic_defs(self, defs, prefix="", sep="|"):
         """Format feature to phoneme set tuples in the form:
@@ -358,7 +585,7 @@ LEXICON SR
     def format_alphabet(self):
         templ = "define {name} [{elements}];\n"
 
-        alphabet = sorted(self.phon_bank.phoneme_feature_sets.keys())
+        alphabet = sorted(self.phon_bank.feature_matrix.phonemes)
         return templ.format(name="alph", elements=separate(alphabet))
 
 
@@ -413,14 +640,34 @@ if __name__ == "__main__":
                         help="Preserve syllable structure.")
     parser.add_argument("--stress", action="store_true",
                         help="Preserve stress.")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Parse the corpus files instead of loading the binary snapshot.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the corpus files line by line rather than holding them in memory.")
+    parser.add_argument("--timings", action="store_true",
+                        help="Report import and construction time per component on stderr.")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Derive URs on interned, array-backed columns rather than dicts of strings.")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Write the UR or SR lexicon as this many independently compilable files.")
+    parser.add_argument("--shard-dir", type=str, default=".",
+                        help="Directory for --shards output.")
     args = parser.parse_args()
 
+    def shard_paths(side):
+        if not os.path.isdir(args.shard_dir):
+            os.makedirs(args.shard_dir)
+        return [
+            os.path.join(args.shard_dir, "%s.lexicon.%d.lexc" % (side, idx))
+            for idx in range(args.shards)]
+
     if args.small:
-        corpus_class = SmallCorpus
+        corpus = SmallCorpus()
     else:
-        corpus_class = Corpus
-
-    corpus = corpus_class(args.syll, args.stress)
+        corpus = Corpus(
+            args.syll, args.stress,
+            use_snapshot=not args.no_snapshot, streaming=args.stream,
+            columnar=args.columnar)
 
     if args.feature_defs:
         print(corpus.format_feature_defs())
@@ -431,11 +678,22 @@ if __name__ == "__main__":
     elif args.features:
         print(corpus.phon_bank.features)
 
+    elif args.ur_lexicon and args.shards:
+        corpus.write_lexicon_shards(corpus.iter_UR_lexicon, shard_paths("ur"))
+
+    elif args.sr_lexicon and args.shards:
+        corpus.write_lexicon_shards(corpus.iter_SR_lexicon, shard_paths("sr"))
+
     elif args.ur_lexicon:
-        print(corpus.format_UR_lexicon())
+        corpus.write_UR_lexicon(sys.stdout)
+        print()
 
     elif args.sr_lexicon:
-        print(corpus.format_SR_lexicon())
+        corpus.write_SR_lexicon(sys.stdout)
+        print()
 
     elif args.alphabet:
         print(corpus.format_alphabet())
+
+    if args.timings:
+        report()
@@ -0,0 +1,152 @@
+import os
+import copy
+from collections import OrderedDict
+import lexc
+from tabulate import (
+    PREDICTIONS,
+    CORRECT_MADE,
+    CORRECT_MISSED,
+    INCORRECT_MADE,
+    TABULATED,
+    UR_LEXICON,
+    SR_LEXICON,
+    FST,
+    read_ruleset,
+)
+
+ALL = os.path.join(PREDICTIONS, 'all.txt')
+
+
+def reconcile(correct_made, correct_missed, incorrect_made):
+    """Credit incorrect predictions that match a missed SR as correct.
+
+    Returns the new (correct made, correct missed, incorrect made) dicts of
+    UR to SR, and a table of UR to (predicted SR, correct SR) for the
+    remaining incorrect predictions."""
+    new_correct_made = copy.copy(correct_made)
+    new_correct_missed = copy.copy(correct_missed)
+    new_incorrect_made = copy.copy(incorrect_made)
+
+    for ur, sr in incorrect_made.items():
+        if ur in correct_missed and correct_missed[ur] == sr:
+            new_correct_made[ur] = sr
+            del new_correct_missed[ur]
+            del new_incorrect_made[ur]
+
+    table = OrderedDict(
+        (ur, (incorrect_made[ur], correct_missed[ur]))
+        for ur in sorted(new_incorrect_made.keys())
+        if ur in correct_missed
+    )
+
+    return new_correct_made, new_correct_missed, new_incorrect_made, table
+
+
+def write_to_file(d, f):
+    for k, v in d.items():
+        f.write('%s\t%s\n' % (
+            k, '\t'.join(v) if isinstance(v, tuple) else v
+        ))
+
+
+class Evaluation:
+    """Evaluate a grammar against the UR and SR lexicons in process.
+
+    Equivalent to test.grammar.foma: predictions are the UR lexicon composed
+    with the grammar's cascade, and are split into correct made (in the SR
+    lexicon), correct missed (in the SR lexicon but not predicted) and
+    incorrect made (predicted but not in the SR lexicon) pairs.
+    """
+
+    def __init__(self, ruleset, ur_pairs, sr_pairs, evaluator=None):
+        """With an IncrementalEvaluator, predictions are pushed through the
+        cascade rule by rule from its cache rather than through the
+        composed transducer."""
+        self.ruleset = ruleset
+        self.ur_pairs = ur_pairs
+        self.sr_pairs = sr_pairs
+
+        if evaluator is not None:
+            self.predictions = [
+                (upper, sr) for upper, lower in ur_pairs for sr in evaluator.outputs(lower)]
+        else:
+            self.predictions = self.predict(ruleset.cascade, ur_pairs)
+
+        correct_made, correct_missed, incorrect_made = self.split(
+            self.predictions, sr_pairs)
+
+        (self.correct_made,
+         self.correct_missed,
+         self.incorrect_made,
+         self.tabulated) = reconcile(correct_made, correct_missed, incorrect_made)
+
+    @classmethod
+    def from_files(cls, grammar_file_name, ur_lexicon=UR_LEXICON, sr_lexicon=SR_LEXICON,
+                   incremental=False):
+        """Evaluate the grammar file against the lexicon files. If
+        incremental, also returns the IncrementalEvaluator used."""
+        ruleset = read_ruleset(grammar_file_name)
+        ur_pairs = lexc.read_pairs(ur_lexicon)
+        sr_pairs = lexc.read_pairs(sr_lexicon)
+
+        if not incremental:
+            return cls(ruleset, ur_pairs, sr_pairs)
+
+        from cascade import IncrementalEvaluator
+        with open(grammar_file_name) as grammar_file:
+            evaluator = IncrementalEvaluator(
+                ruleset, [line.rstrip() for line in grammar_file])
+        return cls(ruleset, ur_pairs, sr_pairs, evaluator=evaluator), evaluator
+
+    @staticmethod
+    def predict(transducer, ur_pairs):
+        """[(UR, SR)] for every output of the transducer on each lexicon
+        entry's lower side, keyed by its upper side."""
+        return [
+            (upper, FST.decode(sr))
+            for upper, lower in ur_pairs
+            for sr in transducer[FST.encode(lower)]
+        ]
+
+    @staticmethod
+    def split(predictions, sr_pairs):
+        """Split predictions into correct made, correct missed and incorrect
+        made dicts of UR to SR, ordered as in the lexicons."""
+        predicted = set(predictions)
+        expected = set(sr_pairs)
+
+        correct_made = OrderedDict(
+            pair for pair in predictions if pair in expected)
+        correct_missed = OrderedDict(
+            pair for pair in sr_pairs if pair not in predicted)
+        incorrect_made = OrderedDict(
+            pair for pair in predictions if pair not in expected)
+
+        return correct_made, correct_missed, incorrect_made
+
+    @property
+    def prediction_dicts(self):
+        return self.correct_made, self.correct_missed, self.incorrect_made
+
+    @property
+    def accuracy(self):
+        total = len(self.correct_made) + len(self.correct_missed)
+        return len(self.correct_made) / total if total else 0.0
+
+    def write(self):
+        """Write the prediction files test.grammar.foma would have."""
+        if not os.path.isdir(PREDICTIONS):
+            os.makedirs(PREDICTIONS)
+
+        with open(ALL, 'w+') as f:
+            for ur, sr in self.predictions:
+                f.write('%s\t%s\n' % (ur, sr))
+
+        for predictions, file in [
+            (self.correct_made, CORRECT_MADE),
+            (self.correct_missed, CORRECT_MISSED),
+            (self.incorrect_made, INCORRECT_MADE),
+            (self.tabulated, TABULATED),
+        ]:
+            with open(file, 'w+') as f:
+                write_to_file(predictions, f)
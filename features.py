@@ -0,0 +1,160 @@
+import re
+import numpy as np
+
+
+class FeatureMatrix:
+    """Phonemes × features as an int8 matrix of +1/-1/0 (undefined), plus
+    one boolean mask (bitset over phonemes) per feature value, e.g. "+son".
+
+    Natural classes are computed as vectorized mask operations:
+
+        >>> matrix.natural_class("+son & -nas")
+    """
+
+    PLUS = 1
+    MINUS = -1
+
+    TOKEN = re.compile(r"\s*(?:(?P<op>[&|~()\[\]])|%?(?P<feature>[+-]\w+))")
+
+    def __init__(self, phonemes, features, matrix):
+        self.phonemes = list(phonemes)
+        self.feature_names = list(features)
+        self.matrix = matrix
+
+        self._index = {phon: idx for idx, phon in enumerate(self.phonemes)}
+        self.masks = {}
+        for col, feature in enumerate(self.feature_names):
+            self.masks["+" + feature] = self.matrix[:, col] == self.PLUS
+            self.masks["-" + feature] = self.matrix[:, col] == self.MINUS
+
+        # Built on first use, then shared by every caller.
+        self._phoneme_feature_sets = None
+        self._feature_phoneme_sets = None
+
+    @classmethod
+    def from_feature_table(cls, phonemes, feature_table):
+        """Build the matrix with a single panphon lookup per phoneme,
+        keeping only phonemes that are a single segment with at least one
+        defined feature."""
+        names = None
+        kept, rows = [], []
+
+        for phon in phonemes:
+            fts = feature_table.word_fts(phon)
+            if len(fts) != 1:
+                continue
+
+            segment = fts[0]
+            if names is None:
+                names = list(segment)
+
+            row = [segment[feat] for feat in names]
+            if any(row):
+                kept.append(phon)
+                rows.append(row)
+
+        matrix = np.array(rows, dtype=np.int8).reshape(len(rows), len(names or []))
+        return cls(kept, names or [], matrix)
+
+    def __contains__(self, phon):
+        return phon in self._index
+
+    def __len__(self):
+        return len(self.phonemes)
+
+    def mask(self, feature):
+        """The phoneme mask for a feature value like "+son" or "%-nas"."""
+        return self.masks[feature.lstrip("%")]
+
+    def phonemes_for(self, mask):
+        return [self.phonemes[idx] for idx in np.flatnonzero(mask)]
+
+    def natural_class(self, query):
+        """Phonemes matching a boolean feature expression, e.g.
+        "+son & -nas", "[+cons & ~+voi] | +syl"."""
+        return self.phonemes_for(self.evaluate(query))
+
+    def evaluate(self, query):
+        tokens = self._tokenize(query)
+        mask, pos = self._parse_union(tokens, 0)
+        if pos != len(tokens):
+            raise ValueError("Unexpected %r in %r" % (tokens[pos], query))
+        return mask
+
+    def _tokenize(self, query):
+        tokens = []
+        pos = 0
+        query = query.rstrip()
+        while pos < len(query):
+            match = self.TOKEN.match(query, pos)
+            if not match:
+                raise ValueError("Can't parse %r at %d" % (query, pos))
+            tokens.append(match.group("op") or match.group("feature"))
+            pos = match.end()
+        return tokens
+
+    def _parse_union(self, tokens, pos):
+        mask, pos = self._parse_intersection(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == "|":
+            other, pos = self._parse_intersection(tokens, pos + 1)
+            mask = mask | other
+        return mask, pos
+
+    def _parse_intersection(self, tokens, pos):
+        mask, pos = self._parse_factor(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == "&":
+            other, pos = self._parse_factor(tokens, pos + 1)
+            mask = mask & other
+        return mask, pos
+
+    def _parse_factor(self, tokens, pos):
+        if pos >= len(tokens):
+            raise ValueError("Unexpected end of expression")
+
+        token = tokens[pos]
+        if token == "~":
+            mask, pos = self._parse_factor(tokens, pos + 1)
+            return ~mask, pos
+
+        if token in "([":
+            mask, pos = self._parse_union(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos] != {"(": ")", "[": "]"}[token]:
+                raise ValueError("Unbalanced %r" % token)
+            return mask, pos + 1
+
+        if token not in self.masks:
+            raise KeyError("Unknown feature value %r" % token)
+        return self.masks[token], pos + 1
+
+    def phoneme_feature_sets(self):
+        """{phoneme: ["+syl", "-son", ...]} with only the features that are
+        defined for the phoneme, in feature table order."""
+        if self._phoneme_feature_sets is None:
+            self._phoneme_feature_sets = {
+                phon: [
+                    "%s%s" % ("+" if value == self.PLUS else "-", feature)
+                    for feature, value in zip(self.feature_names, row) if value
+                ]
+                for phon, row in zip(self.phonemes, self.matrix.tolist())
+            }
+        return self._phoneme_feature_sets
+
+    def feature_phoneme_sets(self):
+        """{"+syl": {phonemes}, ...}, keyed in order of first appearance."""
+        if self._feature_phoneme_sets is None:
+            self._feature_phoneme_sets = self._build_feature_phoneme_sets()
+        return self._feature_phoneme_sets
+
+    def _build_feature_phoneme_sets(self):
+        order = {}
+        for phon, row in zip(self.phonemes, self.matrix.tolist()):
+            for feature, value in zip(self.feature_names, row):
+                if value:
+                    order.setdefault(
+                        "%s%s" % ("+" if value == self.PLUS else "-", feature),
+                        len(order))
+
+        return {
+            feature: set(self.phonemes_for(self.masks[feature]))
+            for feature in sorted(order, key=order.get)
+        }
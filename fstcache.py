@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import ctypes
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict, deque
+from ctypes.util import find_library
+from snapshot import content_hash
+from tabulate import GRAMMAR, FST, FST_CACHE
+from cascade import definitions, definition_hashes, references
+
+VERSION = 1
+
+# Compiled definitions kept per rule name, most recently used first, so
+# switching between a few variants of a grammar doesn't recompile them.
+KEEP = 4
+
+READ_LEXC = re.compile(r'\s*read\s+lexc\s+(\S+)\s*$')
+DEFINE_TOP = re.compile(r'\s*define\s+(\S+)\s*;\s*$')
+SOURCE = re.compile(r'\s*source\s+(\S+)\s*$')
+# What `save defined` can carry over from a sourced file: network
+# definitions, not function definitions or other commands.
+SAVED = re.compile(r'\s*(#.*)?$|\s*define\s+[^\s(]+\s')
+
+_libfoma = None
+
+
+def libfoma():
+    """libfoma, for the calls the foma bindings don't wrap."""
+    global _libfoma
+    if _libfoma is None:
+        path = find_library('foma')
+        if path is None:
+            raise OSError("libfoma not found")
+        _libfoma = ctypes.cdll.LoadLibrary(path)
+        _libfoma.fsm_write_binary_file.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        _libfoma.fsm_write_binary_file.restype = ctypes.c_int
+    return _libfoma
+
+
+def write_binary(fst, path):
+    """Save a compiled FST in foma's binary format, which FST.load reads."""
+    tmp_path = path + '.tmp'
+    handle = ctypes.cast(fst.fsthandle, ctypes.c_void_p)
+    if libfoma().fsm_write_binary_file(handle, FST.encode(tmp_path)) != 0:
+        raise OSError("Couldn't write %s" % tmp_path)
+    os.replace(tmp_path, path)
+
+
+def check_roundtrip(fst, path, probes=()):
+    """Raise OSError unless `path` loads back as the FST written, i.e.
+    unless write_binary works with this libfoma: written out again, the
+    loaded FST must give the same file, and it must map each of the
+    probe strings to the same outputs as `fst`."""
+    loaded = FST.load(path)
+    rewritten = path + '.check'
+    try:
+        write_binary(loaded, rewritten)
+        with open(path, 'rb') as f, open(rewritten, 'rb') as g:
+            same = f.read() == g.read()
+    finally:
+        if os.path.exists(rewritten):
+            os.remove(rewritten)
+    if not same:
+        raise OSError("%s doesn't load back as the FST written" % path)
+
+    for probe in probes:
+        if loaded[FST.encode(probe)] != fst[FST.encode(probe)]:
+            raise OSError("%s loads back with different outputs for %s" % (path, probe))
+
+
+def file_name(name):
+    return re.sub(r'[^\w+\-.]', '_', name)
+
+
+def cache_files(cache_dir, prefix, extension):
+    """Paths in cache_dir of `prefix.<key>.extension` files."""
+    pattern = re.compile(r'%s\.[0-9a-f]{16}\.%s$' % (re.escape(prefix), re.escape(extension)))
+    if not os.path.isdir(cache_dir):
+        return []
+    return [os.path.join(cache_dir, file) for file in os.listdir(cache_dir) if pattern.match(file)]
+
+
+class RuleCache:
+    """Compiled rules on disk, one binary FST per definition.
+
+    A definition's file is keyed by its rule hash, which covers the
+    definitions it depends on, so editing a rule or a feature class only
+    recompiles what's built on it. Keys are handed out in definition
+    order, so a name defined twice gets a key for each definition. Only
+    the KEEP most recently used files of a name are kept.
+    """
+
+    def __init__(self, fomalines, cache_dir=FST_CACHE, salt=''):
+        self.cache_dir = cache_dir
+        self._keys = defaultdict(deque)
+        for name, digest in definition_hashes(fomalines):
+            key = hashlib.sha1(('%d %s %s' % (VERSION, salt, digest)).encode()).hexdigest()
+            self._keys[name].append(key)
+
+        self.hits = 0
+        self.misses = 0
+        self._writable = True
+        self._checked = False
+
+    def next_path(self, name):
+        """The cache file for the next definition of `name`, or None if it
+        isn't one we can key."""
+        keys = self._keys.get(name)
+        if not keys:
+            return None
+        return os.path.join(self.cache_dir, '%s.%s.fsm' % (file_name(name), keys.popleft()[:16]))
+
+    def load(self, path):
+        if path is None or not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Mark it used, for prune().
+        os.utime(path)
+        return FST.load(path)
+
+    def save(self, fst, path):
+        if path is None or not self._writable:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            write_binary(fst, path)
+            if not self._checked:
+                check_roundtrip(fst, path)
+                self._checked = True
+        except (OSError, ValueError, AttributeError) as e:
+            # Compiling still works without the cache.
+            print('Not caching compiled rules: %s' % e, file=sys.stderr)
+            self._writable = False
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        self.prune(path)
+
+    def prune(self, path):
+        """Remove all but the KEEP most recently used files of the rule
+        `path` was saved for."""
+        prefix = os.path.basename(path).rsplit('.', 2)[0]
+        paths = sorted(cache_files(self.cache_dir, prefix, 'fsm'),
+                       key=os.path.getmtime, reverse=True)
+        for stale in paths[KEEP:]:
+            os.remove(stale)
+
+
+def cached_script(script, directory=GRAMMAR, cache_dir=FST_CACHE):
+    """Rewrite a foma script run from `directory` so that lexicons and
+    sourced grammars load from stacks saved by `save defined` instead of
+    being recompiled:
+
+        read lexc FILE / define NAME;   ->  load defined NAME.<key>.defined
+        source FILE                      ->  load defined FILE.<key>.defined
+
+    Each is compiled by foma, under a hash of its files, only when they
+    change. A sourced file is only replaced if everything it does is
+    define networks (functions aren't saved) and it doesn't use
+    definitions made before it in the script (it's compiled alone).
+    Returns the rewritten script's path relative to `directory`."""
+    with open(os.path.join(directory, script)) as f:
+        lines = f.read().splitlines()
+
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    rewritten = []
+    # Names defined so far in the script.
+    defined_names = set()
+    idx = 0
+    while idx < len(lines):
+        line = lines[idx]
+        read = READ_LEXC.match(line)
+        define = DEFINE_TOP.match(lines[idx + 1]) if read and idx + 1 < len(lines) else None
+        source = SOURCE.match(line)
+
+        if read and define:
+            lexc_file, name = read.group(1), define.group(1)
+            key = content_hash([os.path.join(directory, lexc_file)], VERSION, name)
+            commands = ['read lexc %s' % lexc_file, 'define %s;' % name]
+            rewritten.append(load_defined(commands, name, key, directory, cache_dir))
+            defined_names.add(name)
+            idx += 2
+            continue
+
+        if source:
+            source_file = source.group(1)
+            sources = sourced_grammar(os.path.join(directory, source_file), defined_names)
+            if sources is not None:
+                key = content_hash(sources, VERSION)
+                commands = ['source %s' % source_file]
+                rewritten.append(load_defined(
+                    commands, os.path.basename(source_file), key, directory, cache_dir))
+                defined_names.update(defined_in(sources))
+                idx += 1
+                continue
+            # Run as is, but what it defines still counts.
+            defined_names.update(defined_in([os.path.join(directory, source_file)]))
+
+        rewritten.append(line)
+        defined_names.update(name for name, _ in definitions([line]))
+        match = DEFINE_TOP.match(line)
+        if match:
+            defined_names.add(match.group(1))
+        idx += 1
+
+    path = os.path.join(cache_dir, os.path.basename(script))
+    with open(path, 'w') as f:
+        f.write('\n'.join(rewritten) + '\n')
+    return os.path.relpath(path, directory)
+
+
+def sourced_grammar(path, defined_names):
+    """The files a sourced grammar is compiled from, or None if its
+    definitions can't be carried over by `save defined`."""
+    from watch import sourced_files
+
+    with open(path) as f:
+        fomalines = [line.rstrip() for line in f]
+    files = sourced_files(path, fomalines)
+    sources = [path]
+    for file in files:
+        nested = sourced_grammar(file, defined_names)
+        if nested is None:
+            return None
+        sources.extend(nested)
+
+    for line in fomalines:
+        if SOURCE.match(line):
+            continue
+        if not SAVED.match(line):
+            return None
+        if any(references(definition, defined_names) for _, definition in definitions([line])):
+            return None
+    return sources
+
+
+def defined_in(paths):
+    names = set()
+    for path in paths:
+        with open(path) as f:
+            names.update(name for name, _ in definitions(f))
+    return names
+
+
+def load_defined(commands, name, key, directory=GRAMMAR, cache_dir=FST_CACHE):
+    """A `load defined` of the stack the commands define, compiling it
+    first if there's none saved under `key`."""
+    defined = os.path.join(cache_dir, '%s.%s.defined' % (file_name(name), key[:16]))
+    if not os.path.exists(defined):
+        compile_defined(commands, file_name(name), defined, directory)
+    return 'load defined %s' % defined
+
+
+def compile_defined(commands, prefix, defined, directory=GRAMMAR):
+    """Run foma commands and save what they define to `defined`, replacing
+    the stacks saved for earlier versions."""
+    cache_dir = os.path.dirname(defined)
+    for stale in cache_files(cache_dir, prefix, 'defined'):
+        os.remove(stale)
+
+    script = defined + '.foma'
+    with open(script, 'w') as f:
+        f.write('\n'.join(commands + ['save defined %s.tmp' % defined]) + '\n')
+    try:
+        subprocess.run(['foma', '-f', script], cwd=directory, check=True,
+                       stdout=subprocess.DEVNULL)
+    finally:
+        os.remove(script)
+    os.replace(defined + '.tmp', defined)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that compiled rules can be cached with this libfoma: "
+                    "write a rule with write_binary and load it back.")
+    parser.add_argument("--rule", type=str, default="a -> b || c _ d")
+    parser.add_argument("--probes", type=str, nargs="*", default=["cad", "cadcad", "ad", "ca"],
+                        help="strings the loaded rule must map to the same outputs")
+    args = parser.parse_args()
+
+    fst = FST(args.rule)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'rule.fsm')
+        write_binary(fst, path)
+        check_roundtrip(fst, path, args.probes)
+    print('OK: %s round-trips through %s' % (args.rule, find_library('foma')))
+
+
+if __name__ == "__main__":
+    main()
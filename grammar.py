@@ -1,16 +1,22 @@
 import subprocess
 import os
-import copy
-from collections import OrderedDict
+import sys
 from tabulate import (
     GRAMMAR,
     CORRECT_MADE,
     CORRECT_MISSED,
     INCORRECT_MADE,
     TABULATED,
+    UR_LEXICON,
+    SR_LEXICON,
+    Ruleset,
     Tabulator,
     get_parser
 )
+from evaluation import Evaluation, reconcile, write_to_file
+from store import STORE, PredictionStore, grammar_hash
+from compare import Comparison
+from watch import Watcher, INTERVAL
 
 
 def fix_predictions():
@@ -18,12 +24,6 @@ def fix_predictions():
         lines = [line.split() for line in f.readlines()]
         return {ur: sr for ur, sr in lines}
 
-    def write_to_file(d, f):
-        for k, v in d.items():
-            f.write('%s\t%s\n' % (
-                k, '\t'.join(v) if isinstance(v, tuple) else v
-            ))
-
     with open(CORRECT_MADE) as correct_made_f, \
           open(CORRECT_MISSED) as correct_missed_f, \
           open(INCORRECT_MADE) as incorrect_made_f:
@@ -32,45 +32,118 @@ def fix_predictions():
         correct_missed = to_dict(correct_missed_f)
         incorrect_made = to_dict(incorrect_made_f)
 
-        new_correct_made = copy.copy(correct_made)
-        new_correct_missed = copy.copy(correct_missed)
-        new_incorrect_made = copy.copy(incorrect_made)
-
-        for ur, sr in incorrect_made.items():
-            if ur in correct_missed and correct_missed[ur] == sr:
-                new_correct_made[ur] = sr
-                del new_correct_missed[ur]
-                del new_incorrect_made[ur]
-
-        for predictions, file in [
-            (new_correct_made, open(CORRECT_MADE, 'w+')),
-            (new_correct_missed, open(CORRECT_MISSED, 'w+')),
-            (new_incorrect_made, open(INCORRECT_MADE, 'w+')),
-        ]:
-            write_to_file(predictions, file)
+    new_correct_made, new_correct_missed, new_incorrect_made, table = reconcile(
+        correct_made, correct_missed, incorrect_made)
 
-        table = OrderedDict(
-            (ur, (incorrect_made[ur], correct_missed[ur]))
-            for ur in sorted(new_incorrect_made.keys())
-            if ur in correct_missed
-        )
-
-        write_to_file(table, open(TABULATED, 'w+'))
+    for predictions, file in [
+        (new_correct_made, CORRECT_MADE),
+        (new_correct_missed, CORRECT_MISSED),
+        (new_incorrect_made, INCORRECT_MADE),
+        (table, TABULATED),
+    ]:
+        with open(file, 'w+') as f:
+            write_to_file(predictions, f)
 
 
 def main():
     parser = get_parser()
     parser.add_argument("--exception-dir", type=str, help="output dir")
     parser.add_argument("-a", action="store_true", help="append to count file")
+    parser.add_argument("--in-process", action="store_true",
+                        help="evaluate with pyfoma instead of a foma subprocess")
+    parser.add_argument("--write-predictions", action="store_true",
+                        help="with --in-process, also write the prediction files")
+    parser.add_argument("--incremental", action="store_true",
+                        help="with --in-process, reuse cached intermediate forms "
+                             "up to the first changed rule")
+    parser.add_argument("--ur-lexicon", type=str, default=UR_LEXICON)
+    parser.add_argument("--sr-lexicon", type=str, default=SR_LEXICON)
+    parser.add_argument("--store", type=str, nargs="?", const=STORE, default=None,
+                        help="record the run's predictions and rule signatures "
+                             "in a prediction store")
+    parser.add_argument("--compare", type=str, nargs=2, metavar=("OLD", "NEW"),
+                        help="evaluate two grammars in process and print only "
+                             "the predictions that changed")
+    parser.add_argument("--watch", action="store_true",
+                        help="stay resident, re-evaluating in process whenever a "
+                             "grammar or lexicon file is saved")
+    parser.add_argument("--interval", type=float, default=INTERVAL,
+                        help="with --watch, seconds between checks for changes")
     args = parser.parse_args()
 
-    COMMAND = ['foma', '-f', 'test.grammar.foma']
-    subprocess.call(COMMAND, cwd=GRAMMAR)
-
-    fix_predictions()
-
-    tabulator = Tabulator(grammar_file_name=args.grammar)
-    tabulator.tabulate()
+    if args.no_fst_cache:
+        Ruleset.FST_CACHE_DIR = None
+
+    if args.watch:
+        Watcher(
+            args.grammar, ur_lexicon=args.ur_lexicon, sr_lexicon=args.sr_lexicon,
+            interval=args.interval, write_predictions=args.write_predictions).run()
+        return
+
+    if args.compare:
+        comparison = Comparison.from_files(
+            *args.compare, ur_lexicon=args.ur_lexicon, sr_lexicon=args.sr_lexicon)
+        comparison.write()
+        print('Shared %d rules: %d transductions, %d forms reused.' % (
+            comparison.shared_rules, comparison.transductions, comparison.reused),
+            file=sys.stderr)
+        return
+
+    evaluator = None
+    if args.in_process and args.incremental:
+        evaluation, evaluator = Evaluation.from_files(
+            args.grammar, ur_lexicon=args.ur_lexicon, sr_lexicon=args.sr_lexicon,
+            incremental=True)
+    elif args.in_process:
+        evaluation = Evaluation.from_files(
+            args.grammar, ur_lexicon=args.ur_lexicon, sr_lexicon=args.sr_lexicon)
+
+    if args.in_process:
+        if args.write_predictions:
+            evaluation.write()
+
+        tabulator = Tabulator(
+            grammar_file_name=args.grammar,
+            predictions=evaluation.prediction_dicts,
+            ruleset=evaluation.ruleset)
+    else:
+        script = 'test.grammar.foma'
+        if not args.no_fst_cache:
+            from fstcache import cached_script
+            script = cached_script(script)
+
+        COMMAND = ['foma', '-f', script]
+        subprocess.call(COMMAND, cwd=GRAMMAR)
+
+        fix_predictions()
+
+        tabulator = Tabulator(grammar_file_name=args.grammar)
+
+    if args.profile:
+        args.jobs = 1
+        tabulator.ruleset.enable_profile()
+
+    tabulator.tabulate(evaluator=evaluator, jobs=args.jobs)
+
+    if args.memo_stats:
+        tabulator.print_memo_stats()
+
+    if args.profile:
+        tabulator.write_profile(json_file=args.profile_json, sort=args.profile_sort)
+
+    if evaluator is not None:
+        evaluator.save()
+        print('Restarted at rule %d of %d: %d transductions, %d cached forms reused.' % (
+            evaluator.restart_idx, len(evaluator.chain),
+            evaluator.transductions, evaluator.reused))
+
+    if args.store:
+        store = PredictionStore(args.store)
+        run_id = store.record(
+            grammar_hash(args.grammar, args.ur_lexicon, args.sr_lexicon),
+            args.grammar, tabulator)
+        store.close()
+        print('Recorded run %d in %s.' % (run_id, args.store))
 
     if not os.path.exists(args.exception_dir) or not os.path.isdir(args.exception_dir):
         os.mkdir(args.exception_dir)
@@ -0,0 +1,125 @@
+import os
+import re
+import pickle
+from collections import OrderedDict
+from snapshot import content_hash
+
+
+# Parsed lexicons, keyed by a hash of their contents.
+CACHE_DIR = os.path.join("grammar", "cache", "lexc")
+
+ROOT = "Root"
+END = "#"
+EPSILON = "0"
+
+
+class LexcError(Exception):
+    pass
+
+
+def _unescape(form):
+    return re.sub(r"%(.)", r"\1", form)
+
+
+def _split_pair(form):
+    """Split an upper:lower entry on its first unescaped colon."""
+    match = re.match(r"((?:%.|[^:])*):(.*)$", form)
+    if match:
+        upper, lower = match.groups()
+    else:
+        upper = lower = form
+
+    upper = "" if upper == EPSILON else _unescape(upper)
+    lower = "" if lower == EPSILON else _unescape(lower)
+    return upper, lower
+
+
+def parse(lines):
+    """Parse the subset of lexc that Corpus writes: a Multichar_Symbols
+    declaration and LEXICON blocks of `[upper[:lower]] Continuation ;`
+    entries. Returns {lexicon: [(upper, lower, continuation)]}."""
+    lexicons = OrderedDict()
+    current = None
+
+    for lineno, line in enumerate(lines, 1):
+        line = re.sub(r"(?<!%)!.*", "", line).strip()
+        if not line or line.startswith("Multichar_Symbols"):
+            continue
+
+        if line.startswith("LEXICON"):
+            current = line.split()[1]
+            lexicons.setdefault(current, [])
+            continue
+
+        if current is None:
+            raise LexcError("Entry outside of a LEXICON on line %d" % lineno)
+
+        entry = line.rstrip(";").split()
+        if len(entry) == 1:
+            upper, lower, continuation = "", "", entry[0]
+        elif len(entry) == 2:
+            (upper, lower), continuation = _split_pair(entry[0]), entry[1]
+        else:
+            raise LexcError("Can't parse line %d: %r" % (lineno, line))
+
+        lexicons[current].append((upper, lower, continuation))
+
+    return lexicons
+
+
+def pairs(lines, root=ROOT):
+    """Yield every (upper, lower) path through the lexicon starting at
+    `root`, in entry order."""
+    lexicons = parse(lines)
+    if root not in lexicons:
+        # Lexicons without a Root start at their first LEXICON.
+        root = next(iter(lexicons), None)
+        if root is None:
+            return
+
+    stack = [(root, "", "", 0)]
+    while stack:
+        lexicon, upper, lower, idx = stack.pop()
+        entries = lexicons[lexicon]
+        if idx >= len(entries):
+            continue
+
+        # Revisit this lexicon's next entry after the current one's paths.
+        stack.append((lexicon, upper, lower, idx + 1))
+
+        entry_upper, entry_lower, continuation = entries[idx]
+        if continuation == END:
+            yield upper + entry_upper, lower + entry_lower
+        elif continuation in lexicons:
+            stack.append((continuation, upper + entry_upper, lower + entry_lower, 0))
+        else:
+            raise LexcError("Undefined continuation %r in LEXICON %s" % (
+                continuation, lexicon))
+
+
+def read_pairs(path, root=ROOT, cache_dir=CACHE_DIR):
+    """pairs() of a lexc file. The pairs are pickled under `cache_dir`,
+    keyed by a hash of the file, and loaded from there while it's
+    unchanged; a cache_dir of None always parses."""
+    if cache_dir is None:
+        with open(path) as f:
+            return list(pairs(f, root=root))
+
+    name = os.path.basename(path)
+    key = content_hash([path], root)
+    cache_file = os.path.join(cache_dir, "%s.%s.pickle" % (name, key[:16]))
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+
+    with open(path) as f:
+        parsed = list(pairs(f, root=root))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for file in os.listdir(cache_dir):
+        if file.startswith(name + ".") and file.endswith(".pickle"):
+            os.remove(os.path.join(cache_dir, file))
+    with open(cache_file + ".tmp", "wb") as f:
+        pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file + ".tmp", cache_file)
+    return parsed
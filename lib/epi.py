@@ -1,3 +1,5 @@
+import hashlib
+import marisa_trie
 from epitran import Epitran as Epi
 from epitran.simple import (
     SimpleEpitran as SimpleEpi,
@@ -8,21 +10,162 @@ from epitran.simple import (
     csv,
     unicodedata,
     re,
-    MappingError
+    MappingError,
+    ligaturize
 )
 
 
 class ConfigurableEpitran(Epi):
     def __init__(self, code, *args, g2p_loc=None, **kwargs):
+        # Have Epitran construct our backend in place of its own, which
+        # would load and compile the packaged map only to be replaced.
+        def backend(**_):
+            return ConfigurableSimpleEpitran(code, g2p_loc=g2p_loc)
+
+        self.special = dict(Epi.special, **{code: backend})
         super().__init__(code, *args, **kwargs)
-        self.epi = ConfigurableSimpleEpitran(code, g2p_loc=g2p_loc)
+
+
+class LazyRegex:
+    """A compiled regex, compiled on first use."""
+
+    def __init__(self, compile):
+        self._compile = compile
+        self._regex = None
+
+    def __getattr__(self, name):
+        if self._regex is None:
+            self._regex = self._compile()
+        return getattr(self._regex, name)
+
+
+class G2PTrie:
+    """A grapheme-to-phoneme map compiled into a marisa trie for longest
+    match lookups. The compiled trie is persisted in the data cache, keyed
+    by a hash of the map's contents, and memory-mapped on load."""
+
+    CACHE_DIR = "cache"
+
+    def __init__(self, trie):
+        self.trie = trie
+        self.max_len = max((len(graph) for graph in trie.keys()), default=0)
+
+    @classmethod
+    def load(cls, path, parse_map, tones=False):
+        """Load the compiled trie for the map at `path`, compiling it with
+        `parse_map() -> {graph: [phon]}` if the map changed."""
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read())
+        digest.update(b'tones' if tones else b'')
+
+        # data/map/cat-Latn.csv -> data/cache
+        data_dir = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+        cache_dir = os.path.join(data_dir, cls.CACHE_DIR)
+        name = os.path.splitext(os.path.basename(path))[0]
+        trie_path = os.path.join(
+            cache_dir, '{}.{}.marisa'.format(name, digest.hexdigest()[:16]))
+
+        trie = marisa_trie.BytesTrie()
+        if os.path.exists(trie_path):
+            trie.mmap(trie_path)
+            return cls(trie)
+
+        trie = cls.compile(parse_map())
+        os.makedirs(cache_dir, exist_ok=True)
+        for file in os.listdir(cache_dir):
+            if file.startswith(name + '.') and file.endswith('.marisa'):
+                os.remove(os.path.join(cache_dir, file))
+        trie.trie.save(trie_path)
+        return trie
+
+    @classmethod
+    def compile(cls, g2p):
+        return cls(marisa_trie.BytesTrie(
+            (graph, phon.encode('utf-8'))
+            for graph, phons in g2p.items() for phon in phons[:1]))
+
+    @property
+    def g2p(self):
+        g2p = defaultdict(list)
+        for graph, phon in self.trie.items():
+            g2p[graph].append(phon.decode('utf-8'))
+        return g2p
+
+    def match(self, text, pos=0):
+        """Return (graph, phon) for the longest grapheme at `pos`, or None."""
+        graphs = self.trie.prefixes(text[pos:pos + self.max_len])
+        if not graphs:
+            return None
+        graph = max(graphs, key=len)
+        return graph, self.trie[graph][0].decode('utf-8')
+
+    def segment(self, text):
+        """Split text into (segment, is_ipa) pairs, passing unmapped
+        characters through."""
+        tr_list = []
+        pos = 0
+        while pos < len(text):
+            match = self.match(text, pos)
+            if match:
+                graph, phon = match
+                tr_list.append((phon, True))
+                pos += len(graph)
+            else:
+                tr_list.append((text[pos], False))
+                pos += 1
+        return tr_list
 
 
 class ConfigurableSimpleEpitran(SimpleEpi):
 
     def __init__(self, code, *args, g2p_loc=None, **kwargs):
+        self.g2p_loc = g2p_loc
         super().__init__(code, *args, **kwargs)
-        self.g2p = self.__load_g2p_map(code, False, alt_loc=g2p_loc)
+
+    def _load_g2p_map(self, code, rev):
+        """The configured map, from its compiled trie; the map itself is
+        only read when the trie is out of date."""
+        if rev:
+            return super()._load_g2p_map(code, rev)
+        path = self.__g2p_map_path(code, False, alt_loc=self.g2p_loc)
+        self.g2p_trie = G2PTrie.load(
+            path, lambda: self.__load_g2p_map(code, False, alt_loc=self.g2p_loc),
+            tones=self.tones)
+        return self.g2p_trie.g2p
+
+    def _construct_regex(self, g2p_keys):
+        # general_trans matches against the trie; the regex is only
+        # compiled for the methods that still use it.
+        g2p_keys = list(g2p_keys)
+        return LazyRegex(lambda: SimpleEpi._construct_regex(self, g2p_keys))
+
+    def general_trans(self, text, filter_func, normpunc=False, ligatures=False):
+        """As SimpleEpitran.general_trans, but matching graphemes against the
+        compiled trie rather than a regex over the map."""
+        text = unicodedata.normalize('NFD', text.lower())
+        text = self.strip_diacritics.process(text)
+        if self.preproc:
+            text = self.preprocessor.process(text)
+        tr_list = self.g2p_trie.segment(text)
+        for segment, is_ipa in tr_list:
+            if not is_ipa:
+                self.nils[segment] += 2
+        text = ''.join([s for (s, _) in filter(filter_func, tr_list)])
+        if self.postproc:
+            text = self.postprocessor.process(text)
+        if ligatures or self.ligatures:
+            text = ligaturize(text)
+        if normpunc:
+            text = self.puncnorm.norm(text)
+        return unicodedata.normalize('NFC', text)
+
+    def __g2p_map_path(self, code, rev, alt_loc=None):
+        code += '_rev' if rev else ''
+        try:
+            path = alt_loc or os.path.join('data', 'map', code + '.csv')
+            return pkg_resources.resource_filename(__name__, path)
+        except IndexError:
+            raise DatafileError('Add an appropriately-named mapping to the data/maps directory.')
 
     def __load_g2p_map(self, code, rev, alt_loc=None):
         """Load the code table for the specified language.
@@ -33,12 +176,7 @@ class ConfigurableSimpleEpitran(SimpleEpi):
         """
         g2p = defaultdict(list)
         gr_by_line = defaultdict(list)
-        code += '_rev' if rev else ''
-        try:
-            path = alt_loc or os.path.join('data', 'map', code + '.csv')
-            path = pkg_resources.resource_filename(__name__, path)
-        except IndexError:
-            raise DatafileError('Add an appropriately-named mapping to the data/maps directory.')
+        path = self.__g2p_map_path(code, rev, alt_loc=alt_loc)
         with open(path, 'rb') as f:
             reader = csv.reader(f, encoding='utf-8')
             orth, phon = next(reader)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import marisa_trie
+import lexc
+from snapshot import content_hash
+from tabulate import GRAMMAR, BIG_GRAMMAR, UR_LEXICON
+
+CACHE_DIR = os.path.join(GRAMMAR, 'cache')
+NAME = 'lookup'
+
+DOWN = 'down'
+UP = 'up'
+
+
+def _grammar_sources(grammar_file_name):
+    from watch import sourced_files
+    with open(grammar_file_name) as grammar_file:
+        fomalines = [line.rstrip() for line in grammar_file]
+    return [grammar_file_name] + sourced_files(grammar_file_name, fomalines)
+
+
+class LookupTable:
+    """Every generated form of the UR lexicon, in a pair of marisa tries:
+    UR+tag -> SR (down) and SR -> UR+tag (up).
+
+    The tries are built by running the cascade over the whole lexicon once,
+    saved under grammar/cache keyed by a hash of the grammar, the files it
+    sources and the lexicon, and memory-mapped on load. Words missing from
+    the table go to the FST, which is only compiled on the first miss.
+    """
+
+    def __init__(self, down, up, fallback=None):
+        """fallback: () -> a service.Generator, for words not in the table."""
+        self.down = down
+        self.up = up
+        self._fallback = fallback
+        self._generator = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def paths(cls, key, cache_dir=CACHE_DIR):
+        return {
+            direction: os.path.join(cache_dir, '%s.%s.%s.marisa' % (NAME, key[:16], direction))
+            for direction in (DOWN, UP)
+        }
+
+    @classmethod
+    def load_or_build(cls, grammar_file_name=BIG_GRAMMAR, ur_lexicon=UR_LEXICON,
+                      cache_dir=CACHE_DIR, fallback=None, ruleset=None):
+        """Load the tries for the grammar and lexicon, building them first
+        if either changed. The ruleset, if given, saves compiling the
+        grammar for a build."""
+        key = content_hash(_grammar_sources(grammar_file_name) + [ur_lexicon])
+        paths = cls.paths(key, cache_dir)
+
+        if not all(os.path.exists(path) for path in paths.values()):
+            if ruleset is None:
+                from tabulate import read_ruleset
+                ruleset = read_ruleset(grammar_file_name)
+            down, up = cls.build(ruleset, lexc.read_pairs(ur_lexicon))
+
+            os.makedirs(cache_dir, exist_ok=True)
+            for file in os.listdir(cache_dir):
+                if file.startswith(NAME + '.') and file.endswith('.marisa'):
+                    os.remove(os.path.join(cache_dir, file))
+            for trie, direction in [(down, DOWN), (up, UP)]:
+                trie.save(paths[direction] + '.tmp')
+                os.replace(paths[direction] + '.tmp', paths[direction])
+
+        tries = []
+        for direction in (DOWN, UP):
+            trie = marisa_trie.BytesTrie()
+            trie.mmap(paths[direction])
+            tries.append(trie)
+
+        if fallback is None:
+            def fallback():
+                from service import Generator
+                return Generator.from_files(grammar_file_name, ur_lexicon, table=False)
+
+        return cls(*tries, fallback=fallback)
+
+    @staticmethod
+    def build(ruleset, ur_pairs):
+        """(down, up) tries of every (UR+tag, SR) the cascade generates for
+        the lexicon."""
+        from evaluation import Evaluation
+        predictions = Evaluation.predict(ruleset.cascade, ur_pairs)
+        return (
+            marisa_trie.BytesTrie((ur, sr.encode()) for ur, sr in predictions),
+            marisa_trie.BytesTrie((sr, ur.encode()) for ur, sr in predictions),
+        )
+
+    @staticmethod
+    def _values(trie, key):
+        values = trie.get(key)
+        return None if values is None else [value.decode() for value in values]
+
+    def srs(self, ur):
+        """The SRs of a UR in the table, or None."""
+        return self._values(self.down, ur)
+
+    def urs(self, sr):
+        """The URs of an SR in the table, or None."""
+        return self._values(self.up, sr)
+
+    @property
+    def generator(self):
+        if self._generator is None:
+            self._generator = self._fallback()
+        return self._generator
+
+    def generate(self, ur):
+        srs = self.srs(ur)
+        if srs is not None:
+            self.hits += 1
+            return srs
+        self.misses += 1
+        return self.generator.generate(ur)['srs']
+
+    def analyze(self, sr):
+        urs = self.urs(sr)
+        if urs is not None:
+            self.hits += 1
+            return urs
+        self.misses += 1
+        return self.generator.analyze(sr)['urs']
+
+    def __len__(self):
+        return len(self.down)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Look words up in the precomputed lexicon table, "
+                    "falling back to the grammar.")
+    parser.add_argument("words", type=str, nargs="*",
+                        help="URs (or SRs with --up); read from stdin if none")
+    parser.add_argument("--up", action="store_true", help="analyze SRs into URs")
+    parser.add_argument("--grammar", type=str, default=BIG_GRAMMAR)
+    parser.add_argument("--ur-lexicon", type=str, default=UR_LEXICON)
+    args = parser.parse_args()
+
+    table = LookupTable.load_or_build(args.grammar, args.ur_lexicon)
+    lookup = table.analyze if args.up else table.generate
+
+    words = args.words or (line.strip() for line in sys.stdin)
+    for word in words:
+        if word:
+            print('%s\t%s' % (word, '\t'.join(lookup(word))))
+
+    print('%d in the table, %d from the grammar.' % (table.hits, table.misses),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import itertools
+from multiprocessing import Pool
+import lexc
+from tabulate import (
+    BIG_GRAMMAR,
+    UR_LEXICON,
+    SR_LEXICON,
+    CASCADE,
+    FST,
+    read_ruleset,
+)
+from evaluation import Evaluation, reconcile
+from cascade import definitions, references
+
+
+BASELINE = 'baseline'
+
+
+def unused_rules(ruleset, fomalines):
+    """Defined rules that aren't in the cascade or used by any other
+    definition. Composites, like NasalPlaceAssim, are offered in place of
+    their parts, unless the cascade already has all of their parts, like
+    Syllabify. Rules are taken to be the capitalized defines."""
+    defined = dict(definitions(fomalines))
+    rules = [name for name in defined if name[:1].isupper() and name != CASCADE]
+
+    used = set(ruleset.rc)
+    parts = {}
+    for name, definition in defined.items():
+        referenced = references(definition, defined.keys() - {name})
+        used |= referenced
+        parts[name] = referenced.intersection(rules)
+
+    return [
+        name for name in rules
+        if name not in used and name in ruleset.rules
+        and not (parts[name] and parts[name] <= set(ruleset.rc))
+    ]
+
+
+def moves(order):
+    """Every ordering with one rule moved elsewhere in the cascade."""
+    for idx, rule in enumerate(order):
+        rest = order[:idx] + order[idx + 1:]
+        for new_idx in range(len(order)):
+            if new_idx == idx:
+                continue
+            candidate = rest[:new_idx] + (rule,) + rest[new_idx:]
+            if new_idx < len(rest):
+                yield 'move %s before %s' % (rule, rest[new_idx]), candidate
+            else:
+                yield 'move %s last' % rule, candidate
+
+
+def ablations(order):
+    for idx, rule in enumerate(order):
+        yield 'drop %s' % rule, order[:idx] + order[idx + 1:]
+
+
+def insertions(order, rules):
+    for rule in rules:
+        for idx in range(len(order) + 1):
+            candidate = order[:idx] + (rule,) + order[idx:]
+            if idx < len(order):
+                yield 'insert %s before %s' % (rule, order[idx]), candidate
+            else:
+                yield 'insert %s last' % rule, candidate
+
+
+def candidates(order, move=True, ablate=True, insert=()):
+    """{order: description} for the baseline and each variant, keeping the
+    first description of orders reachable more than one way."""
+    order = tuple(order)
+    generators = [[(BASELINE, order)]]
+    if move:
+        generators.append(moves(order))
+    if ablate:
+        generators.append(ablations(order))
+    if insert:
+        generators.append(insertions(order, insert))
+
+    found = {}
+    for description, candidate in itertools.chain.from_iterable(generators):
+        found.setdefault(candidate, description)
+    return found
+
+
+class Scorer:
+    """Score rule orderings by accuracy against the SR lexicon.
+
+    Orderings are scored in sorted order, keeping the forms of every word
+    after each rule of the last ordering on a stack; the next ordering
+    only runs the rules after the prefix it shares with the last. Across
+    orderings, the ruleset's transduction memo catches the same rule being
+    applied to the same form at a different position.
+    """
+
+    def __init__(self, ruleset, ur_pairs, sr_pairs):
+        self.ruleset = ruleset
+        self.ur_pairs = ur_pairs
+        self.sr_pairs = sr_pairs
+        self.words = sorted({lower for _, lower in ur_pairs})
+
+        # [(rule, forms of self.words after it)]
+        self._stack = []
+        self.transductions = 0
+
+    def forms(self, order):
+        shared = 0
+        for (rule, _), new_rule in zip(self._stack, order):
+            if rule != new_rule:
+                break
+            shared += 1
+        del self._stack[shared:]
+
+        forms = [
+            (word.encode(),) for word in self.words
+        ] if not self._stack else self._stack[-1][1]
+
+        for rule in order[shared:]:
+            self.transductions += sum(len(word_forms) for word_forms in forms)
+            forms = [self.ruleset.transduce_forms(rule, word_forms) for word_forms in forms]
+            self._stack.append((rule, forms))
+
+        return dict(zip(self.words, (
+            [FST.decode(form) for form in word_forms] for word_forms in forms)))
+
+    def score(self, order):
+        """(accuracy, correct made, incorrect made) for the ordering."""
+        outputs = self.forms(order)
+        predictions = [
+            (upper, sr) for upper, lower in self.ur_pairs for sr in outputs[lower]]
+
+        correct_made, correct_missed, incorrect_made, _ = reconcile(
+            *Evaluation.split(predictions, self.sr_pairs))
+
+        total = len(correct_made) + len(correct_missed)
+        accuracy = len(correct_made) / total if total else 0.0
+        return accuracy, len(correct_made), len(incorrect_made)
+
+    def score_all(self, orders):
+        return [(order,) + self.score(order) for order in sorted(orders)]
+
+
+# The scorer of a search worker process, loaded once by _init_worker.
+_worker_scorer = None
+
+
+def _init_worker(grammar_file_name, ur_lexicon, sr_lexicon):
+    global _worker_scorer
+    _worker_scorer = Scorer(
+        read_ruleset(grammar_file_name),
+        lexc.read_pairs(ur_lexicon),
+        lexc.read_pairs(sr_lexicon))
+
+
+def _score_all(orders):
+    return _worker_scorer.score_all(orders)
+
+
+def search(grammar_file_name, ur_lexicon=UR_LEXICON, sr_lexicon=SR_LEXICON,
+           move=True, ablate=True, insert=None, jobs=1, ruleset=None):
+    """Score the grammar's cascade and its variants. Returns
+    [(accuracy, correct, incorrect, description, order)], best first.
+
+    insert defaults to the grammar's unused rules. Orderings are sorted
+    before being split into one contiguous shard per worker, so orderings
+    that share long prefixes land in the same worker."""
+    with open(grammar_file_name) as grammar_file:
+        fomalines = [line.rstrip() for line in grammar_file]
+
+    if ruleset is None:
+        ruleset = read_ruleset(grammar_file_name)
+    if insert is None:
+        insert = unused_rules(ruleset, fomalines)
+
+    unknown = [rule for rule in insert if rule not in ruleset.rules]
+    if unknown:
+        raise KeyError('Not defined in %s: %s' % (grammar_file_name, ', '.join(unknown)))
+
+    found = candidates(ruleset.rc, move=move, ablate=ablate, insert=insert)
+    orders = sorted(found)
+
+    if jobs > 1:
+        size = -(-len(orders) // jobs)
+        shards = [orders[idx:idx + size] for idx in range(0, len(orders), size)]
+        with Pool(jobs, initializer=_init_worker,
+                  initargs=(grammar_file_name, ur_lexicon, sr_lexicon)) as pool:
+            scores = list(itertools.chain.from_iterable(pool.map(_score_all, shards)))
+    else:
+        scorer = Scorer(ruleset, lexc.read_pairs(ur_lexicon), lexc.read_pairs(sr_lexicon))
+        scores = scorer.score_all(orders)
+
+    return sorted(
+        [
+            (accuracy, correct, incorrect, found[order], order)
+            for order, accuracy, correct, incorrect in scores
+        ],
+        key=lambda row: (-row[0], row[2], row[3] != BASELINE)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rule ordering and ablation search.")
+    parser.add_argument("--grammar", type=str, default=BIG_GRAMMAR)
+    parser.add_argument("--ur-lexicon", type=str, default=UR_LEXICON)
+    parser.add_argument("--sr-lexicon", type=str, default=SR_LEXICON)
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="score orderings across this many worker processes")
+    parser.add_argument("--top", type=int, default=20,
+                        help="print this many orderings (0 for all)")
+    parser.add_argument("--no-moves", action="store_true",
+                        help="don't try moving each rule elsewhere")
+    parser.add_argument("--no-ablations", action="store_true",
+                        help="don't try dropping each rule")
+    parser.add_argument("--insert", type=str, nargs="*", default=None,
+                        help="rules to try inserting at each position "
+                             "(by default, every defined rule not in the cascade)")
+    args = parser.parse_args()
+
+    ruleset = read_ruleset(args.grammar)
+    unknown = [rule for rule in args.insert or [] if rule not in ruleset.rules]
+    if unknown:
+        parser.error("--insert: not defined in %s: %s" % (args.grammar, ', '.join(unknown)))
+
+    results = search(
+        args.grammar, ur_lexicon=args.ur_lexicon, sr_lexicon=args.sr_lexicon,
+        move=not args.no_moves, ablate=not args.no_ablations,
+        insert=args.insert, jobs=args.jobs, ruleset=ruleset)
+
+    print('RANK\tACCURACY\tCORRECT\tINCORRECT\tCHANGE\tORDER')
+    for rank, (accuracy, correct, incorrect, description, order) in enumerate(
+            results[:args.top or None], 1):
+        print('%d\t%.4f\t%d\t%d\t%s\t%s' % (
+            rank, accuracy, correct, incorrect, description, ' .o. '.join(order)))
+
+    print('%d orderings scored.' % len(results), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
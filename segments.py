@@ -0,0 +1,78 @@
+import os
+import re
+from functools import lru_cache
+
+
+PHONEMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar", "phonemes.foma")
+
+SYLL = "-"
+STRESS = "1"
+MARKERS = [SYLL, STRESS]
+
+# Multichar symbols of the UR and SR lexicons.
+TAGS = ["+Masc", "+Fem"]
+
+DEFINE = re.compile(r"^\s*define\s+(\S+)\s", re.M)
+
+
+def foma_symbols(path=PHONEMES):
+    """The names of the defines in a foma file, unescaped. phonemes.foma
+    defines one per phoneme."""
+    with open(path) as f:
+        return [re.sub(r"%(.)", r"\1", name) for name in DEFINE.findall(f.read())]
+
+
+class Tokenizer:
+    """Longest-match segmentation of forms into phonemes and markers.
+
+    The multichar symbols are compiled into one regular expression, longest
+    first, so that segments like t͡ʃ and d͡ʒ come out whole; every other
+    character is a segment of its own.
+
+    The batch methods read a whole file at once and leave the per-form
+    work to the compiled expression.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = sorted(set(symbols) - {""}, key=lambda symbol: (-len(symbol), symbol))
+        self._pattern = re.compile("|".join(
+            [re.escape(symbol) for symbol in self.symbols if len(symbol) > 1] + ["."]))
+        self._findall = self._pattern.findall
+
+    @classmethod
+    def from_foma(cls, path=PHONEMES, extra=()):
+        return cls(foma_symbols(path) + MARKERS + TAGS + list(extra))
+
+    @classmethod
+    def from_phonemes(cls, phonemes):
+        return cls(list(phonemes) + MARKERS + TAGS)
+
+    def __call__(self, form):
+        return self._findall(form)
+
+    tokenize = __call__
+
+    def tokenize_many(self, forms):
+        """[segments] for each form."""
+        findall = self._findall
+        return [findall(form) for form in forms]
+
+    def tokenize_text(self, text):
+        """[[segments for each whitespace separated field] for each line]."""
+        findall = self._findall
+        return [
+            [findall(field) for field in line.split()]
+            for line in text.splitlines()
+        ]
+
+    def tokenize_file(self, path):
+        """tokenize_text on a whole file, e.g. a prediction file of UR and SR
+        columns."""
+        with open(path) as f:
+            return self.tokenize_text(f.read())
+
+
+@lru_cache(maxsize=None)
+def default(path=PHONEMES):
+    """The tokenizer for the grammar's alphabet, compiled once per process."""
+    return Tokenizer.from_foma(path)
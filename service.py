@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import lexc
+from tabulate import BIG_GRAMMAR, UR_LEXICON, FST, read_ruleset
+from lookup import LookupTable
+
+HOST = "127.0.0.1"
+PORT = 8750
+
+# How long the batcher waits for more requests after the first, and the
+# most words it runs at once.
+WINDOW = 0.002
+MAX_BATCH = 4096
+
+# Latencies kept for the metrics percentiles.
+LATENCY_WINDOW = 10000
+
+MAX_BODY = 1 << 24
+
+GENERATE = "generate"
+ANALYZE = "analyze"
+
+
+class UnknownTag(ValueError):
+    pass
+
+
+class Generator:
+    """The compiled grammar, for generating SRs from URs and analyzing SRs
+    back into URs.
+
+    URs are as on the upper side of the UR lexicon, e.g. ə-βə-1lid+Fem.
+    The tag is spelled out with the lexicon's tag suffixes before the
+    cascade applies, so URs needn't be in the lexicon. Analyses are the
+    cascade's upward outputs that are lower sides of lexicon entries.
+
+    With a LookupTable, words in the lexicon are answered from the table
+    and only the rest, and traces, go through the cascade.
+    """
+
+    def __init__(self, ruleset, ur_lexicon_lines, table=None):
+        self.ruleset = ruleset
+        self.cascade = ruleset.cascade
+        self.table = table
+
+        lexicons = lexc.parse(ur_lexicon_lines)
+        # tag -> its lower side, e.g. +Fem -> ə
+        self.suffixes = {
+            upper: lower
+            for entries in lexicons.values()
+            for upper, lower, continuation in entries
+            if upper.startswith("+") and continuation == lexc.END
+        }
+        # lower side -> [URs]
+        self.urs = defaultdict(list)
+        for upper, lower in lexc.pairs(ur_lexicon_lines):
+            self.urs[lower].append(upper)
+
+    @classmethod
+    def from_files(cls, grammar_file_name=BIG_GRAMMAR, ur_lexicon=UR_LEXICON, table=True):
+        with open(ur_lexicon) as f:
+            ur_lexicon_lines = f.readlines()
+        ruleset = read_ruleset(grammar_file_name)
+        if table:
+            table = LookupTable.load_or_build(
+                grammar_file_name, ur_lexicon, ruleset=ruleset)
+        return cls(ruleset, ur_lexicon_lines, table=table or None)
+
+    def underlying(self, ur):
+        """The form the cascade applies to: the stem with its tag spelled
+        out. Raises UnknownTag for tags the lexicon doesn't have."""
+        stem, plus, tag = ur.partition("+")
+        if not plus:
+            return ur
+        if plus + tag not in self.suffixes:
+            raise UnknownTag("Unknown tag in %s: %s" % (ur, plus + tag))
+        return stem + self.suffixes[plus + tag]
+
+    def generate(self, ur, trace=False):
+        if self.table is not None and not trace:
+            srs = self.table.srs(ur)
+            if srs is not None:
+                return {"ur": ur, "srs": srs}
+
+        lower = self.underlying(ur)
+        result = {
+            "ur": ur,
+            "srs": [FST.decode(sr) for sr in self.cascade[lower.encode()]],
+        }
+        if trace:
+            derivation = self.ruleset.derive(lower.encode())
+            result["rules"] = derivation.rules
+            result["derivation"] = self.ruleset.format_derivation(derivation)
+        return result
+
+    def analyze(self, sr, trace=False):
+        if self.table is not None and not trace:
+            urs = self.table.urs(sr)
+            if urs is not None:
+                return {"sr": sr, "urs": urs}
+
+        lowers = [FST.decode(lower) for lower in self.cascade.apply_up(sr.encode())]
+        result = {
+            "sr": sr,
+            "urs": [ur for lower in lowers for ur in self.urs.get(lower, [])],
+        }
+        if trace:
+            result["underlying"] = lowers
+        return result
+
+
+class Metrics:
+    """Request counts and latencies, per endpoint, over the last
+    LATENCY_WINDOW requests."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = defaultdict(int)
+        self.words = defaultdict(int)
+        self.errors = 0
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.batches = 0
+        self.batched_words = 0
+
+    def record(self, endpoint, words, seconds):
+        self.requests[endpoint] += 1
+        self.words[endpoint] += words
+        self.latencies[endpoint].append(seconds)
+
+    def record_batch(self, words):
+        self.batches += 1
+        self.batched_words += words
+
+    @staticmethod
+    def percentiles(latencies):
+        if not latencies:
+            return {}
+        ordered = sorted(latencies)
+
+        def at(fraction):
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+        return {
+            "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": at(0.5),
+            "p90_ms": at(0.9),
+            "p99_ms": at(0.99),
+            "max_ms": ordered[-1] * 1000,
+        }
+
+    def to_dict(self):
+        return {
+            "uptime_s": time.time() - self.started,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_words": self.batched_words / self.batches if self.batches else 0.0,
+            "endpoints": {
+                endpoint: dict(
+                    requests=self.requests[endpoint],
+                    words=self.words[endpoint],
+                    **self.percentiles(self.latencies[endpoint]))
+                for endpoint in self.requests
+            },
+        }
+
+
+class Batcher:
+    """Coalesce concurrent requests into batches.
+
+    Requests queue up while a batch runs; the next batch takes everything
+    queued within WINDOW of its first request, up to MAX_BATCH words, and
+    runs each distinct word once. Batches run on a single worker thread,
+    since the ruleset's memo and foma's apply handles aren't shared safely
+    between threads, and so that the event loop keeps accepting requests.
+    """
+
+    def __init__(self, generator, metrics, window=WINDOW, max_batch=MAX_BATCH):
+        self.generator = generator
+        self.metrics = metrics
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, op, words, trace):
+        """(results, seconds queued, size of the batch that ran them)."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((op, words, trace, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][1])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[1])
+
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.process, batch)
+            except Exception as e:
+                for *_, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.metrics.record_batch(size)
+            for (_, _, _, future, queued), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result((result, started - queued, size))
+
+    def process(self, batch):
+        """Each request's results, or the exception that failed it, so a
+        bad word only fails its own request."""
+        done = {}
+        results = []
+        for op, words, trace, _, _ in batch:
+            apply = self.generator.generate if op == GENERATE else self.generator.analyze
+            request_results = []
+            try:
+                for word in words:
+                    key = (op, word, trace)
+                    if key not in done:
+                        done[key] = apply(word, trace=trace)
+                    request_results.append(done[key])
+            except Exception as e:
+                request_results = e
+            results.append(request_results)
+        return results
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+class Service:
+    """A JSON over HTTP/1.1 endpoint, on localhost or a Unix socket:
+
+        POST /generate  {"urs": [UR, ...], "trace": false}
+        POST /analyze   {"srs": [SR, ...], "trace": false}
+        GET  /metrics
+        GET  /health
+
+    Responses carry their results along with the request's latency, the
+    time it spent queued and the size of the batch it ran in.
+    """
+
+    def __init__(self, generator, window=WINDOW, max_batch=MAX_BATCH):
+        self.metrics = Metrics()
+        self.batcher = Batcher(generator, self.metrics, window=window, max_batch=max_batch)
+
+    async def handle(self, method, path, body):
+        if path == "/health":
+            return {"status": "ok"}
+        if path == "/metrics":
+            return self.metrics.to_dict()
+
+        if path not in ("/" + GENERATE, "/" + ANALYZE):
+            raise HTTPError(404, "No such endpoint: %s" % path)
+        if method != "POST":
+            raise HTTPError(405, "POST a JSON request to %s" % path)
+
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, "Invalid JSON: %s" % e)
+
+        op = path[1:]
+        field = "urs" if op == GENERATE else "srs"
+        words = request.get(field) if isinstance(request, dict) else None
+        if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            raise HTTPError(400, "Expected {\"%s\": [strings]}" % field)
+
+        start = time.perf_counter()
+        try:
+            results, queued, batch_words = await self.batcher.submit(
+                op, words, bool(request.get("trace")))
+        except UnknownTag as e:
+            raise HTTPError(400, str(e))
+        latency = time.perf_counter() - start
+        self.metrics.record(op, len(words), latency)
+
+        return {
+            "results": results,
+            "latency_ms": latency * 1000,
+            "queue_ms": queued * 1000,
+            "batch_words": batch_words,
+        }
+
+    async def connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                status = 200
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY:
+                        raise HTTPError(413, "Request body over %d bytes" % MAX_BODY)
+                    body = await reader.readexactly(length) if length else b""
+                    response = await self.handle(method, path.split("?")[0], body)
+                except HTTPError as e:
+                    status, response = e.status, {"error": str(e)}
+                    self.metrics.errors += 1
+                except Exception as e:
+                    status, response = 500, {"error": repr(e)}
+                    self.metrics.errors += 1
+
+                payload = json.dumps(response, ensure_ascii=False).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write((
+                    "HTTP/1.1 %d %s\r\n"
+                    "Content-Type: application/json; charset=utf-8\r\n"
+                    "Content-Length: %d\r\n"
+                    "Connection: %s\r\n\r\n" % (
+                        status, REASONS.get(status, ""), len(payload),
+                        "keep-alive" if keep_alive else "close")
+                ).encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, socket_path=None):
+        if socket_path:
+            server = await asyncio.start_unix_server(self.connection, path=socket_path)
+            where = socket_path
+        else:
+            server = await asyncio.start_server(self.connection, host=host, port=port)
+            where = "http://%s:%d" % (host, port)
+
+        batcher = asyncio.create_task(self.batcher.run())
+        print("Serving %s." % where, file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve generation and analysis with the compiled grammar.")
+    parser.add_argument("--grammar", type=str, default=BIG_GRAMMAR)
+    parser.add_argument("--ur-lexicon", type=str, default=UR_LEXICON)
+    parser.add_argument("--host", type=str, default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--socket", type=str, help="listen on this Unix socket instead")
+    parser.add_argument("--window", type=float, default=WINDOW,
+                        help="seconds to wait for more requests to batch with the first")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH,
+                        help="most words per batch")
+    parser.add_argument("--no-table", action="store_true",
+                        help="run every word through the cascade rather than "
+                             "the precomputed lexicon table")
+    args = parser.parse_args()
+
+    generator = Generator.from_files(args.grammar, args.ur_lexicon, table=not args.no_table)
+    service = Service(generator, window=args.window, max_batch=args.max_batch)
+    try:
+        asyncio.run(service.serve(args.host, args.port, socket_path=args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+
+
+CACHE_DIR = os.path.join("data", "cache")
+
+MAGIC = b"CAFSNAP1"
+VERSION = 1
+
+# Little-endian header length following the magic bytes.
+HEADER_LEN = struct.Struct("<I")
+
+ALIGN = 8
+
+
+def content_hash(paths, *flags):
+    """Hash the contents of the given files along with any flags that
+    influence how they are preprocessed."""
+    digest = hashlib.sha1(str(VERSION).encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    digest.update(repr(flags).encode())
+    return digest.hexdigest()
+
+
+class Interner:
+    """Assign small consecutive ids to strings in order of appearance."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __call__(self, string):
+        idx = self.ids.get(string)
+        if idx is None:
+            idx = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return idx
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class OrthRows:
+    """Lazy row view over the orth columns of a snapshot, yielding the same
+    dicts as csv.DictReader would."""
+
+    def __init__(self, snapshot, fieldnames):
+        self.snapshot = snapshot
+        self.fieldnames = fieldnames
+
+    def __len__(self):
+        return len(self.snapshot.infl_ids)
+
+    def __getitem__(self, idx):
+        string = self.snapshot.string
+        infl, lemma, key = self.fieldnames
+        return {
+            infl: string(self.snapshot.infl_ids[idx]),
+            lemma: string(self.snapshot.lemma_ids[idx]),
+            key: string(self.snapshot.key_ids[idx]),
+        }
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+
+class PhonRows:
+    """Lazy row view over the phon columns of a snapshot, yielding
+    preprocessed, space separated rows."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot.phon_offsets) - 1
+
+    def __getitem__(self, idx):
+        return " ".join(self.snapshot.segments(idx))
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+
+class Snapshot:
+    """A build-once, memory-mapped image of the orth and phon banks.
+
+    Strings (inflections, lemmas, keys) and phonemes are interned. The orth
+    bank is stored as three columns of string ids, the phon bank as one flat
+    buffer of phoneme ids plus row offsets into it. The file is keyed by
+    a content hash of the source files and the preprocessing flags, and is
+    rebuilt whenever that key changes.
+    """
+
+    # name, typecode
+    SECTIONS = [
+        ("string_data", "B"),
+        ("string_offsets", "I"),
+        ("infl_ids", "I"),
+        ("lemma_ids", "I"),
+        ("key_ids", "I"),
+        ("phon_ids", "H"),
+        ("phon_offsets", "I"),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        self._views = [view]
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a corpus snapshot: %s" % path)
+
+        (header_len,) = HEADER_LEN.unpack_from(view, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LEN.size
+        self.header = json.loads(
+            bytes(view[header_start:header_start + header_len]).decode())
+
+        self.key = self.header["key"]
+        self.phoneme_table = self.header["phonemes"]
+
+        for name, typecode in self.SECTIONS:
+            offset, length = self.header["sections"][name]
+            section = view[offset:offset + length]
+            self._views.append(section)
+            if typecode != "B":
+                section = section.cast(typecode)
+                self._views.append(section)
+            setattr(self, name, section)
+
+        self._strings = {}
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    def string(self, idx):
+        string = self._strings.get(idx)
+        if string is None:
+            start, end = self.string_offsets[idx], self.string_offsets[idx + 1]
+            string = self._strings[idx] = bytes(self.string_data[start:end]).decode()
+        return string
+
+    def segments(self, idx):
+        table = self.phoneme_table
+        start, end = self.phon_offsets[idx], self.phon_offsets[idx + 1]
+        return [table[phon_id] for phon_id in self.phon_ids[start:end]]
+
+    @property
+    def phonemes(self):
+        return {phon for phon in self.phoneme_table if phon}
+
+    def orth_rows(self, fieldnames):
+        return OrthRows(self, fieldnames)
+
+    def phon_rows(self):
+        return PhonRows(self)
+
+    @classmethod
+    def write(cls, path, key, orth_rows, phon_rows, fieldnames):
+        """Serialize orth rows (dicts keyed by `fieldnames`) and phon rows
+        (lists of segments) to `path`."""
+        strings = Interner()
+        phonemes = Interner()
+
+        infl_field, lemma_field, key_field = fieldnames
+        infl_ids, lemma_ids, key_ids = array("I"), array("I"), array("I")
+        for row in orth_rows:
+            infl_ids.append(strings(row[infl_field]))
+            lemma_ids.append(strings(row[lemma_field]))
+            key_ids.append(strings(row[key_field]))
+
+        phon_ids, phon_offsets = array("H"), array("I", [0])
+        for segments in phon_rows:
+            phon_ids.extend(phonemes(segment) for segment in segments)
+            phon_offsets.append(len(phon_ids))
+
+        if len(phon_offsets) - 1 != len(infl_ids):
+            raise ValueError("Orth and phon banks differ in length: %d != %d" % (
+                len(infl_ids), len(phon_offsets) - 1))
+
+        string_data = bytearray()
+        string_offsets = array("I", [0])
+        for string in strings.strings:
+            string_data.extend(string.encode())
+            string_offsets.append(len(string_data))
+
+        payloads = {
+            "string_data": bytes(string_data),
+            "string_offsets": string_offsets.tobytes(),
+            "infl_ids": infl_ids.tobytes(),
+            "lemma_ids": lemma_ids.tobytes(),
+            "key_ids": key_ids.tobytes(),
+            "phon_ids": phon_ids.tobytes(),
+            "phon_offsets": phon_offsets.tobytes(),
+        }
+
+        def pad(n):
+            return -n % ALIGN
+
+        # Section offsets depend on the header length, and the header holds
+        # the section offsets, so settle on a header size first.
+        header = {"key": key, "phonemes": phonemes.strings, "sections": {}}
+        header_start = len(MAGIC) + HEADER_LEN.size
+        header_size = len(json.dumps(header).encode()) + 64 * len(payloads)
+        offset = header_start + header_size + pad(header_start + header_size)
+
+        for name, _ in cls.SECTIONS:
+            length = len(payloads[name])
+            header["sections"][name] = [offset, length]
+            offset += length + pad(length)
+
+        header_bytes = json.dumps(header).encode()
+        assert len(header_bytes) <= header_size
+        header_bytes = header_bytes.ljust(header_size)
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LEN.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for name, _ in cls.SECTIONS:
+                f.seek(header["sections"][name][0])
+                f.write(payloads[name])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, name, sources, flags, build_rows, fieldnames, cache_dir=CACHE_DIR):
+        """Load the snapshot for `sources` and `flags`, building it first
+        with `build_rows() -> (orth_rows, phon_rows)` if it's missing or
+        stale."""
+        key = content_hash(sources, *flags)
+        path = os.path.join(cache_dir, "%s.%s.snap" % (name, key[:16]))
+
+        if os.path.exists(path):
+            snapshot = cls(path)
+            if snapshot.key == key:
+                return snapshot
+            snapshot.close()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Stale snapshots of the same corpus.
+        for file in os.listdir(cache_dir):
+            if file.startswith(name + ".") and file.endswith(".snap"):
+                os.remove(os.path.join(cache_dir, file))
+
+        orth_rows, phon_rows = build_rows()
+        cls.write(path, key, orth_rows, phon_rows, fieldnames)
+        return cls(path)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import itertools
+from collections import OrderedDict, defaultdict
+
+# As in tabulate, which is only imported where needed since it loads foma.
+GRAMMAR = 'grammar'
+PREDICTIONS = os.path.join(GRAMMAR, 'predictions')
+UR_LEXICON = os.path.join(GRAMMAR, 'big.ur.lexicon.lexc')
+SR_LEXICON = os.path.join(GRAMMAR, 'big.sr.lexicon.lexc')
+
+STORE = os.path.join(PREDICTIONS, 'predictions.sqlite')
+
+CORRECT_MADE = 'correct-made'
+CORRECT_MISSED = 'correct-missed'
+INCORRECT_MADE = 'incorrect-made'
+
+KINDS = [CORRECT_MADE, CORRECT_MISSED, INCORRECT_MADE]
+
+# Kinds that tabulate() assigns rule signatures to, and their
+# Tabulator prediction types.
+TABULATED_KINDS = {
+    CORRECT_MADE: 'CORRECT',
+    INCORRECT_MADE: 'INCORRECT',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    grammar_hash TEXT UNIQUE NOT NULL,
+    grammar_file TEXT NOT NULL,
+    created REAL NOT NULL,
+    cascade TEXT
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    ur TEXT NOT NULL,
+    sr TEXT NOT NULL,
+    rules TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_run_kind ON predictions (run_id, kind);
+CREATE INDEX IF NOT EXISTS predictions_ur ON predictions (ur, run_id);
+CREATE INDEX IF NOT EXISTS predictions_rules ON predictions (run_id, rules);
+"""
+
+
+def grammar_hash(grammar_file_name, ur_lexicon=UR_LEXICON, sr_lexicon=SR_LEXICON):
+    """Hash the grammar, the files it sources and the lexicons it was
+    evaluated against."""
+    # Only imported here, since watch loads foma.
+    from watch import sourced_files
+    with open(grammar_file_name) as grammar_file:
+        fomalines = [line.rstrip() for line in grammar_file]
+    sources = sourced_files(grammar_file_name, fomalines)
+
+    digest = hashlib.sha1()
+    for path in [grammar_file_name] + sources + [ur_lexicon, sr_lexicon]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class PredictionStore:
+    """An SQLite store of evaluation runs, keyed by grammar content hash.
+
+    Each run keeps its correct made, correct missed and incorrect made
+    predictions along with their rule signatures, indexed by UR, so lookups,
+    run comparisons and exception tables are queries rather than re-parses
+    of the prediction files.
+    """
+
+    def __init__(self, path=STORE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+        # Stores from before runs kept their cascade.
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(runs)')]
+        if 'cascade' not in columns:
+            self.connection.execute('ALTER TABLE runs ADD COLUMN cascade TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, grammar_hash, grammar_file_name, tabulator):
+        """Store a tabulated run, replacing any earlier run of the same
+        grammar. Returns the run id."""
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM runs WHERE grammar_hash = ?', (grammar_hash,))
+            run_id = self.connection.execute(
+                'INSERT INTO runs (grammar_hash, grammar_file, created, cascade) '
+                'VALUES (?, ?, ?, ?)',
+                (grammar_hash, grammar_file_name, time.time(),
+                 ' '.join(tabulator.rule_order))).lastrowid
+
+            for kind, predictions in [
+                (CORRECT_MADE, tabulator.correct_predictions),
+                (CORRECT_MISSED, tabulator.missed_predictions),
+                (INCORRECT_MADE, tabulator.incorrect_predictions),
+            ]:
+                self.connection.executemany(
+                    'INSERT INTO predictions (run_id, kind, ur, sr, rules) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        (run_id, kind, ur, prediction[tabulator.SR],
+                         prediction[tabulator.RULES] if kind in TABULATED_KINDS else None)
+                        for ur, prediction in predictions.items()
+                    ))
+
+        return run_id
+
+    def runs(self):
+        return self.connection.execute(
+            'SELECT id, grammar_hash, grammar_file, created FROM runs ORDER BY id').fetchall()
+
+    def run_id(self, run=None):
+        """Resolve a run id, grammar hash (or a prefix of one), or None for
+        the latest run."""
+        if run is None:
+            row = self.connection.execute('SELECT max(id) FROM runs').fetchone()
+        elif str(run).isdigit():
+            row = self.connection.execute(
+                'SELECT id FROM runs WHERE id = ?', (int(run),)).fetchone()
+        else:
+            row = self.connection.execute(
+                'SELECT id FROM runs WHERE grammar_hash LIKE ? ORDER BY id DESC',
+                (run + '%',)).fetchone()
+
+        if row is None or row[0] is None:
+            raise KeyError('No such run: %s' % run)
+        return row[0]
+
+    def grammar_file(self, run_id):
+        return self.connection.execute(
+            'SELECT grammar_file FROM runs WHERE id = ?', (run_id,)).fetchone()[0]
+
+    def cascade(self, run_id):
+        """The run's rule order, or None if it wasn't stored."""
+        cascade = self.connection.execute(
+            'SELECT cascade FROM runs WHERE id = ?', (run_id,)).fetchone()[0]
+        return cascade.split() if cascade is not None else None
+
+    def predictions(self, run_id, kind):
+        """UR -> SR for one kind of prediction, in the order recorded."""
+        return OrderedDict(self.connection.execute(
+            'SELECT ur, sr FROM predictions WHERE run_id = ? AND kind = ? ORDER BY rowid',
+            (run_id, kind)))
+
+    def prediction_dicts(self, run_id):
+        return tuple(self.predictions(run_id, kind) for kind in KINDS)
+
+    def signatures(self, run_id, kind):
+        return self.connection.execute(
+            'SELECT ur, rules FROM predictions WHERE run_id = ? AND kind = ? ORDER BY rowid',
+            (run_id, kind)).fetchall()
+
+    def lookup(self, ur, run_id=None):
+        """[(run id, kind, SR, rules)] for a UR, in one run or all of them."""
+        query = 'SELECT run_id, kind, sr, rules FROM predictions WHERE ur = ?'
+        params = [ur]
+        if run_id is not None:
+            query += ' AND run_id = ?'
+            params.append(run_id)
+        return self.connection.execute(query + ' ORDER BY run_id', params).fetchall()
+
+    def signature_counts(self, run_id):
+        """[(rules, correct, incorrect)] ordered by signature."""
+        return self.connection.execute(
+            '''SELECT rules,
+                      sum(kind = ?) AS correct,
+                      sum(kind = ?) AS incorrect
+               FROM predictions
+               WHERE run_id = ? AND rules IS NOT NULL
+               GROUP BY rules ORDER BY rules''',
+            (CORRECT_MADE, INCORRECT_MADE, run_id)).fetchall()
+
+    def made(self, run_id):
+        """UR -> [(kind, SR, rules)] of the run's made predictions."""
+        made = defaultdict(list)
+        for ur, kind, sr, rules in self.connection.execute(
+                '''SELECT ur, kind, sr, rules FROM predictions
+                   WHERE run_id = ? AND kind != ? ORDER BY rowid''',
+                (run_id, CORRECT_MISSED)):
+            made[ur].append((kind, sr, rules))
+        return made
+
+    def compare(self, old_run_id, new_run_id):
+        """[(UR, old kind, old SR, old rules, new kind, new SR, new rules)]
+        for URs predicted in both runs whose SRs, correctness or signatures
+        changed. A UR's predictions are compared as sets; those only in the
+        old run are paired up with those only in the new one, and the
+        sides of unpaired ones are None."""
+        old, new = self.made(old_run_id), self.made(new_run_id)
+        changes = []
+        for ur in sorted(old.keys() & new.keys()):
+            old_only = [prediction for prediction in old[ur] if prediction not in new[ur]]
+            new_only = [prediction for prediction in new[ur] if prediction not in old[ur]]
+            for old_prediction, new_prediction in itertools.zip_longest(
+                    old_only, new_only, fillvalue=(None, None, None)):
+                changes.append((ur,) + old_prediction + new_prediction)
+        return changes
+
+    def tabulator(self, run_id, grammar_file_name=None, ruleset=None):
+        """A Tabulator with the run's predictions and stored signatures, ready
+        to write exception tables without re-running the cascade. The
+        grammar is only compiled if the run has no stored cascade, or if
+        the tabulator's ruleset is used."""
+        from tabulate import Tabulator
+        tabulator = Tabulator(
+            grammar_file_name=grammar_file_name or self.grammar_file(run_id),
+            predictions=self.prediction_dicts(run_id),
+            ruleset=ruleset,
+            rule_order=self.cascade(run_id))
+
+        for kind, prediction_type in TABULATED_KINDS.items():
+            tabulator.record(prediction_type, self.signatures(run_id, kind))
+
+        return tabulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction store queries.")
+    parser.add_argument("--store", type=str, default=STORE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("runs", help="list stored runs")
+
+    lookup_parser = subparsers.add_parser("lookup", help="predictions for a UR")
+    lookup_parser.add_argument("ur", type=str)
+    lookup_parser.add_argument("--run", type=str)
+
+    counts_parser = subparsers.add_parser("count", help="signature counts for a run")
+    counts_parser.add_argument("--run", type=str)
+
+    compare_parser = subparsers.add_parser("compare", help="changed predictions between runs")
+    compare_parser.add_argument("old", type=str)
+    compare_parser.add_argument("new", type=str)
+
+    tables_parser = subparsers.add_parser("tables", help="regenerate exception tables for a run")
+    tables_parser.add_argument("--run", type=str)
+    tables_parser.add_argument("--grammar", type=str, default=None)
+    tables_parser.add_argument("--exception-dir", type=str, required=True)
+
+    args = parser.parse_args()
+    store = PredictionStore(args.store)
+
+    if args.command == "runs":
+        for run_id, digest, grammar_file, created in store.runs():
+            print("%d\t%s\t%s\t%s" % (
+                run_id, digest[:12], grammar_file,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))))
+
+    elif args.command == "lookup":
+        run_id = store.run_id(args.run) if args.run else None
+        for row in store.lookup(args.ur, run_id):
+            print("\t".join(str(col) if col is not None else "" for col in row))
+
+    elif args.command == "count":
+        for rules, correct, incorrect in store.signature_counts(store.run_id(args.run)):
+            print("%s\t%d\t%d" % (rules, correct, incorrect))
+
+    elif args.command == "compare":
+        for row in store.compare(store.run_id(args.old), store.run_id(args.new)):
+            print("\t".join(col if col is not None else "" for col in row))
+
+    elif args.command == "tables":
+        run_id = store.run_id(args.run)
+        tabulator = store.tabulator(run_id, grammar_file_name=args.grammar)
+
+        if not os.path.isdir(args.exception_dir):
+            os.mkdir(args.exception_dir)
+
+        tabulator.write_tabulation_examples(
+            file=os.path.join(args.exception_dir, 'incorrect-table.csv'),
+            prediction_type=tabulator.INCORRECT)
+        tabulator.write_tabulation_examples(
+            file=os.path.join(args.exception_dir, 'correct-table.csv'),
+            prediction_type=tabulator.CORRECT)
+        tabulator.write_tabulation_count(
+            file=os.path.join(args.exception_dir, 'count.csv'))
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@
 import os
 import copy
 import csv
-from collections import defaultdict, OrderedDict
+import sys
+import json
+import time
+from collections import defaultdict, OrderedDict, namedtuple
+from functools import lru_cache
 import pprint
 import argparse
 import itertools
-from pyfoma.phonrule import Ruleset as _Ruleset
+import re
+from multiprocessing import Pool
+from pyfoma.phonrule import Ruleset as _Ruleset, FST
 
 GRAMMAR = 'grammar'
 PREDICTIONS = os.path.join(GRAMMAR, 'predictions')
@@ -17,29 +23,261 @@ INCORRECT_MADE = os.path.join(PREDICTIONS, 'incorrect-made.txt')
 TABULATED = os.path.join(PREDICTIONS, 'incorrect-tabulated.txt')
 
 BIG_GRAMMAR = os.path.join(GRAMMAR, 'big.grammar.foma')
+UR_LEXICON = os.path.join(GRAMMAR, 'big.ur.lexicon.lexc')
+SR_LEXICON = os.path.join(GRAMMAR, 'big.sr.lexicon.lexc')
+
+# The name of the composed cascade in grammar files.
+CASCADE = 'Grammar'
+
+# Compiled rules and lexicons, keyed by content hashes; see fstcache.py.
+FST_CACHE = os.path.join(GRAMMAR, 'cache', 'fst')
+
+
+# forms: the word's form after each rule in the cascade
+# rules: the rules that changed it, in order
+Derivation = namedtuple('Derivation', ['word', 'forms', 'rules'])
+
+
+class RuleProfile:
+    """Counters for one rule: transductions, transductions that changed the
+    form, cumulative seconds, and a histogram of input lengths in bytes.
+    Only transductions foma actually runs are counted, not memo hits."""
+
+    def __init__(self):
+        self.calls = 0
+        self.changes = 0
+        self.seconds = 0.0
+        self.lengths = defaultdict(int)
+
+    def to_dict(self):
+        total = sum(self.lengths.values())
+        return {
+            'calls': self.calls,
+            'changes': self.changes,
+            'change_rate': self.changes / self.calls if self.calls else 0.0,
+            'seconds': self.seconds,
+            'us_per_call': self.seconds / self.calls * 1e6 if self.calls else 0.0,
+            'input_length': {
+                'min': min(self.lengths) if total else 0,
+                'max': max(self.lengths) if total else 0,
+                'mean': sum(length * n for length, n in self.lengths.items()) / total
+                        if total else 0.0,
+                'histogram': {str(length): self.lengths[length] for length in sorted(self.lengths)},
+            },
+        }
 
 
 class Ruleset(_Ruleset):
+    MEMO_SIZE = 1 << 17
+
+    # Where compiled rules are cached, or None to always compile.
+    FST_CACHE_DIR = FST_CACHE
+
+    def __init__(self, memo_size=MEMO_SIZE):
+        super().__init__()
+        self.memo_size = memo_size
+        # Many URs share intermediate forms (e.g. once Inflection has
+        # stripped the features), so transductions are memoized on
+        # (rule name, input form).
+        self.transduce_all = lru_cache(maxsize=memo_size)(self._transduce_all)
+        # rule name -> RuleProfile, once enable_profile() is called
+        self.profile = None
+        # The fstcache.RuleCache while readrules() runs
+        self.rule_cache = None
+        # The lines the rules were read from, for rebuilding the ruleset
+        # in another process.
+        self.fomalines = None
+
+    def enable_profile(self):
+        """Route transductions through per-rule counters. Off by default,
+        since it costs a couple of clock reads per transduction. The
+        counters sit beneath the memo, so they measure the rules rather than
+        the memo; this starts a fresh memo."""
+        if self.profile is not None:
+            return
+
+        self.profile = defaultdict(RuleProfile)
+        profile = self.profile
+
+        def transduce_all(rule_name, form):
+            start = time.perf_counter()
+            transduced = self._transduce_all(rule_name, form)
+            rule_profile = profile[rule_name]
+            rule_profile.seconds += time.perf_counter() - start
+            rule_profile.calls += 1
+            rule_profile.lengths[len(form)] += 1
+            if transduced != (form,):
+                rule_profile.changes += 1
+            return transduced
+
+        self.transduce_all = lru_cache(maxsize=self.memo_size)(transduce_all)
+
+    def profile_report(self):
+        """{rule: counters} for the cascade's rules, in cascade order, then
+        any others that were transduced."""
+        profile = self.profile or {}
+        rules = list(self.rc) + [rule for rule in profile if rule not in self.rc]
+        return OrderedDict(
+            (rule, (profile[rule] if rule in profile else RuleProfile()).to_dict())
+            for rule in rules
+        )
+
+    def readrules(self, fomalines):
+        """As phonrule's readrules, but grammars without a chain statement
+        take their rule order from the `define Grammar A .o. B ...;` line."""
+        fomalines = list(fomalines)
+        self.fomalines = fomalines
+        self.transduce_all.cache_clear()
+
+        if self.FST_CACHE_DIR:
+            from fstcache import RuleCache
+            self.rule_cache = RuleCache(
+                fomalines, cache_dir=self.FST_CACHE_DIR, salt=repr(self.zerosymbols))
+        try:
+            super().readrules(fomalines)
+        finally:
+            self.rule_cache = None
+
+        if not self.rc:
+            self.rc = self.cascade_from_definition(fomalines)
+
+    def rule_add(self, rulename, rule, commentline):
+        """As phonrule's rule_add, but loading the compiled rule from the
+        rule cache when its definition and dependencies haven't changed."""
+        cache = self.rule_cache
+        if cache is None:
+            return super().rule_add(rulename, rule, commentline)
+
+        path = cache.next_path(rulename)
+        compiled = cache.load(path)
+        if compiled is None:
+            super().rule_add(rulename, rule, commentline)
+            cache.save(self.rules[rulename], path)
+            return
+
+        # Later definitions refer to it by name.
+        FST.define(compiled, rulename)
+        self.rules[rulename] = compiled
+        self.comments[rulename] = commentline
+
+    def cascade_from_definition(self, fomalines, name=CASCADE):
+        for line in fomalines:
+            match = re.match(r'\s*define\s+%s\s+([^;#]+);' % re.escape(name), line)
+            if not match:
+                continue
+
+            rules = [rule.strip() for rule in match.group(1).split('.o.')]
+            if all(rule in self.rules for rule in rules):
+                return rules
+
+        return []
+
+    @property
+    def cascade(self):
+        """The composed grammar transducer."""
+        return self.rules[CASCADE]
+
+    def _transduce_all(self, rule_name, form):
+        return tuple(self.rules[rule_name][form])
+
+    def transduce(self, rule_name, form):
+        """The rule's first output for the form, as phonrule's applyrules
+        takes it."""
+        return self.transduce_all(rule_name, form)[0]
+
+    def transduce_forms(self, rule_name, forms):
+        """Every output of the rule for any of the forms, in order and
+        without repeats."""
+        return tuple(dict.fromkeys(
+            output for form in forms for output in self.transduce_all(rule_name, form)))
+
+    def derive(self, word):
+        """Trace the word through the cascade in one pass, recording every
+        intermediate form and the rules that fired."""
+        if isinstance(word, str):
+            word = word.encode()
+
+        forms = []
+        rules = []
+        prev = word
+        for rule_name in self.rc:
+            transduced = self.transduce(rule_name, prev)
+            if transduced != prev:
+                rules.append(rule_name)
+            forms.append(transduced)
+            prev = transduced
+
+        return Derivation(word, forms, rules)
+
     def applicable_rules_for_word(self, word):
         """Return the list of rules that apply in order."""
-        _applicable_rules = []
+        return self.derive(word).rules
+
+    def format_derivation(self, derivation, printall=False):
+        """Render a derivation like phonrule's applyrules:
+        word[Rule|comment]form[Rule]form..."""
+        s = FST.decode(derivation.word)
+        prev = derivation.word
+        for rule_name, form in zip(self.rc, derivation.forms):
+            if form != prev or printall:
+                comment = self.comments.get(rule_name, '')
+                if comment != '':
+                    s += "[" + rule_name + "|" + comment + "]"
+                else:
+                    s += "[" + rule_name + "]"
+                s += FST.decode(form)
+            prev = form
+        return s
+
+    def memo_stats(self):
+        info = self.transduce_all.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
 
-        def transduce(prev, rule_idx=0):
-            rule_name = self.rc[rule_idx]
-            transducer = self.rules[rule_name]
-            transduced = transducer[prev][0]
 
-            if transduced != prev:
-                _applicable_rules.append(rule_name)
+def read_ruleset(grammar_file_name):
+    with open(grammar_file_name) as grammar_file:
+        grammar_lines = [line.rstrip() for line in grammar_file]
+        ruleset = Ruleset()
+        ruleset.readrules(grammar_lines)
+    return ruleset
+
+
+def rules_string(applicable_rules):
+    return "".join("[%s]" % rule for rule in applicable_rules)
+
+
+def new_count_row():
+    # A module level factory rather than a lambda so that counts pickle.
+    return defaultdict(int)
+
+
+def new_index_row():
+    return defaultdict(list)
 
-            if rule_idx + 1 > len(self.rc) - 1:
-                return transduced
 
-            transduce(transduced, rule_idx + 1)
+# The ruleset of a tabulation worker process, loaded once by _init_worker.
+_worker_ruleset = None
 
-        transduce(word)
 
-        return _applicable_rules
+def _init_worker(fomalines):
+    global _worker_ruleset
+    _worker_ruleset = Ruleset()
+    _worker_ruleset.readrules(fomalines)
+
+
+def _rules_strings(shard):
+    prediction_type, urs = shard
+    return prediction_type, [
+        rules_string(_worker_ruleset.applicable_rules_for_word(ur.encode()))
+        for ur in urs
+    ]
 
 
 class Tabulator:
@@ -52,26 +290,46 @@ class Tabulator:
 
     PREDICTION_TYPES = [CORRECT, INCORRECT]
 
-    def __init__(self, grammar_file_name):
-        with open(CORRECT_MADE) as correct_made_f, \
-             open(CORRECT_MISSED) as correct_missed_f, \
-             open(INCORRECT_MADE) as incorrect_made_f:
+    def __init__(self, grammar_file_name, predictions=None, ruleset=None, rule_order=None):
+        """Predictions are read from the prediction files unless given as
+        (correct made, correct missed, incorrect made) dicts of UR to SR,
+        e.g. by an in-process evaluation. The ruleset is read from the
+        grammar file when first needed unless given, and not at all for
+        count tables if the rule order is given."""
+        if predictions is not None:
+            correct_made, correct_missed, incorrect_made = predictions
+            self._correct_made = self.from_pairs(correct_made.items())
+            self._correct_missed = self.from_pairs(correct_missed.items())
+            self._incorrect_made = self.from_pairs(incorrect_made.items())
+        else:
+            with open(CORRECT_MADE) as correct_made_f, \
+                 open(CORRECT_MISSED) as correct_missed_f, \
+                 open(INCORRECT_MADE) as incorrect_made_f:
 
-            self._correct_made = self.to_dict(correct_made_f)
-            self._correct_missed = self.to_dict(correct_missed_f)
-            self._incorrect_made = self.to_dict(incorrect_made_f)
+                self._correct_made = self.to_dict(correct_made_f)
+                self._correct_missed = self.to_dict(correct_missed_f)
+                self._incorrect_made = self.to_dict(incorrect_made_f)
 
-        with open(grammar_file_name) as grammar_file:
-            grammar_lines = [line.rstrip() for line in grammar_file]
-            self._ruleset = Ruleset()
-            self._ruleset.readrules(grammar_lines)
+        self._ruleset = ruleset
+        self._rule_order = rule_order
 
-        self._rule_application_count = defaultdict(lambda: defaultdict(lambda: 0))
+        self._grammar_file_name = grammar_file_name
+        self._rule_application_count = defaultdict(new_count_row)
+        # rule signature -> prediction type -> URs, in tabulation order
+        self._signature_index = defaultdict(new_index_row)
 
     @property
     def ruleset(self):
+        if self._ruleset is None:
+            self._ruleset = read_ruleset(self._grammar_file_name)
         return self._ruleset
 
+    @property
+    def rule_order(self):
+        if self._rule_order is not None:
+            return self._rule_order
+        return self.ruleset.rc
+
     @property
     def missed_predictions(self):
         return self._correct_missed
@@ -107,11 +365,45 @@ class Tabulator:
         else:
             return self._rule_application_count
 
+    def signature_index(self, prediction_type=None):
+        """The rule signature -> URs index built by tabulate(), for one
+        prediction type or, by default, all of them."""
+        if prediction_type:
+            return {
+                signature: list(urs[prediction_type])
+                for signature, urs in self._signature_index.items()
+            }
+        else:
+            return self._signature_index
+
+    def urs_for_signature(self, signature, prediction_type):
+        if signature not in self._signature_index:
+            return []
+        return self._signature_index[signature][prediction_type]
+
+    def rule_application_examples(self, prediction_type=None):
+        """{signature: {prediction type: [(UR, predicted SR)]}}, restricted
+        to one prediction type if given."""
+        prediction_types = [prediction_type] if prediction_type else Tabulator.PREDICTION_TYPES
+        return {
+            signature: {
+                prediction_type: [
+                    (ur, self.prediction_dicts_map[prediction_type][ur][Tabulator.SR])
+                    for ur in self.urs_for_signature(signature, prediction_type)
+                ]
+                for prediction_type in prediction_types
+            }
+            for signature in self._signature_index
+        }
+
     def to_dict(self, f):
         lines = [line.split() for line in f.readlines()]
+        return self.from_pairs(lines)
+
+    def from_pairs(self, pairs):
         return {
             ur: {Tabulator.UR: ur, Tabulator.SR: sr, Tabulator.RULES: ''}
-            for ur, sr in lines
+            for ur, sr in pairs
         }
 
     def write_to_file(self, d, f):
@@ -120,40 +412,124 @@ class Tabulator:
                 k, '\t'.join(v) if isinstance(v, tuple) else v
             ))
 
-    def tabulate(self):
-        for prediction_dict, prediction_type in [
+    def tabulate(self, evaluator=None, jobs=1):
+        """Record the rules that apply to each correct and incorrect UR.
+
+        An IncrementalEvaluator, if given, supplies them from its per-rule
+        cache instead of re-running the whole cascade. Otherwise, with
+        jobs > 1, URs are sharded across worker processes that each load
+        the ruleset once; results are merged in the serial order, so the
+        counts and tables come out the same."""
+        prediction_dicts = [
             (self.correct_predictions, Tabulator.CORRECT),
             (self.incorrect_predictions, Tabulator.INCORRECT)
-        ]:
-            urs = prediction_dict.keys()
+        ]
 
-            for ur in urs:
-                applicable_rules = self.ruleset.applicable_rules_for_word(
-                    ur.encode()
-                )
+        if evaluator is None and jobs > 1:
+            urs_by_type = [
+                (prediction_type, list(prediction_dict.keys()))
+                for prediction_dict, prediction_type in prediction_dicts
+            ]
+            for prediction_type, urs, strings in self._parallel_rules_strings(urs_by_type, jobs):
+                self.record(prediction_type, zip(urs, strings))
+            return
+
+        if evaluator is not None:
+            def rules_strings(urs):
+                return [rules_string(evaluator.applicable_rules(ur)) for ur in urs]
+        else:
+            def rules_strings(urs):
+                return [
+                    rules_string(self.ruleset.applicable_rules_for_word(ur.encode()))
+                    for ur in urs
+                ]
 
-                applicable_rules_string = "".join(
-                    "[%s]" % rule for rule in applicable_rules
-                )
+        for prediction_dict, prediction_type in prediction_dicts:
+            urs = list(prediction_dict.keys())
+            self.record(prediction_type, zip(urs, rules_strings(urs)))
+
+    def record(self, prediction_type, signatures):
+        """Record (UR, rule signature) pairs for one prediction type, as
+        computed by tabulate() or restored from a PredictionStore."""
+        prediction_dict = self.prediction_dicts_map[prediction_type]
+
+        for ur, applicable_rules_string in signatures:
+            self._rule_application_count[applicable_rules_string][prediction_type] += 1
+            self._rule_application_count[applicable_rules_string][Tabulator.RULES] = applicable_rules_string
+
+            prediction_dict[ur][Tabulator.RULES] = applicable_rules_string
+            self._signature_index[applicable_rules_string][prediction_type].append(ur)
+
+    def _parallel_rules_strings(self, urs_by_type, jobs):
+        """[(prediction type, URs, rules strings)] for [(prediction type,
+        URs)], computed in one pool over shards of every type."""
+        # A few shards per worker to even out the load.
+        total = sum(len(urs) for _, urs in urs_by_type)
+        size = max(1, -(-total // (jobs * 4)))
+        shards = [
+            (prediction_type, urs[idx:idx + size])
+            for prediction_type, urs in urs_by_type
+            for idx in range(0, len(urs), size)
+        ]
 
-                self._rule_application_count[applicable_rules_string][prediction_type] += 1
-                self._rule_application_count[applicable_rules_string][Tabulator.RULES] = applicable_rules_string
+        # Workers rebuild the tabulator's own ruleset, which may not be
+        # the one in the grammar file.
+        fomalines = self._ruleset.fomalines if self._ruleset is not None else None
+        if fomalines is None:
+            with open(self._grammar_file_name) as grammar_file:
+                fomalines = [line.rstrip() for line in grammar_file]
 
-                prediction_dict[ur][Tabulator.RULES] = applicable_rules_string
+        with Pool(jobs, initializer=_init_worker, initargs=(fomalines,)) as pool:
+            results = pool.map(_rules_strings, shards)
+
+        strings = defaultdict(list)
+        for prediction_type, shard_strings in results:
+            strings[prediction_type].extend(shard_strings)
+        return [
+            (prediction_type, urs, strings[prediction_type])
+            for prediction_type, urs in urs_by_type
+        ]
 
     def derivation_for_word(self, word):
-        return self.ruleset.applyrules(word.encode(), printall=False)
+        return self.ruleset.format_derivation(self.ruleset.derive(word))
 
     def original(self):
         with open(TABULATED) as f:
             for line in f.readlines():
-                ur = line.split()[0].encode()
-                yield self.ruleset.applyrules(ur, printall=False)
+                ur = line.split()[0]
+                yield self.ruleset.format_derivation(self.ruleset.derive(ur))
+
+    def write_profile(self, json_file=None, sort='seconds', file=sys.stderr):
+        """Print the ruleset's per-rule profile as a table sorted by `sort`,
+        descending, and write it as JSON to json_file if given."""
+        report = self.ruleset.profile_report()
+
+        if json_file:
+            with open(json_file, 'w') as f:
+                json.dump(report, f, indent=2)
+
+        width = max([len(rule) for rule in report] + [len('RULE')])
+        print('%-*s %10s %10s %7s %10s %9s %13s' % (
+            width, 'RULE', 'CALLS', 'CHANGES', 'CHANGE%', 'SECONDS', 'US/CALL',
+            'LEN MIN/AVG/MAX'), file=file)
+        for rule, stats in sorted(report.items(), key=lambda item: -item[1][sort]):
+            lengths = stats['input_length']
+            print('%-*s %10d %10d %6.1f%% %10.3f %9.1f %13s' % (
+                width, rule, stats['calls'], stats['changes'],
+                stats['change_rate'] * 100, stats['seconds'], stats['us_per_call'],
+                '%d/%.1f/%d' % (lengths['min'], lengths['mean'], lengths['max'])),
+                file=file)
+
+    def print_memo_stats(self, file=sys.stderr):
+        stats = self.ruleset.memo_stats()
+        print('Transduction memo: %(hits)d hits, %(misses)d misses '
+              '(%(hit_rate).1f%% hit rate), %(size)d/%(maxsize)d entries' % dict(
+                  stats, hit_rate=stats['hit_rate'] * 100), file=file)
 
     def write_tabulation_count(self, file, append=False):
         ORDER = "ORDER"
         rule_order = [
-            {ORDER: rulename} for rulename in self.ruleset.rc
+            {ORDER: rulename} for rulename in self.rule_order
         ]
 
         mode = "a" if append else "w"
@@ -204,34 +580,32 @@ class Tabulator:
                 delimiter='\t'
             )
 
+            correct_column_src = {
+                Tabulator.CORRECT: self.correct_predictions,
+                Tabulator.INCORRECT: self.missed_predictions
+            }[prediction_type]
+
+            row_src = self.prediction_dicts_map[prediction_type]
+
+            row_inclusion_predicate = {
+                Tabulator.INCORRECT: lambda ur: ur in self.missed_predictions,
+                Tabulator.CORRECT: lambda _: True  # noop
+            }[prediction_type]
+
             for ruleset in sorted(
                 self._rule_application_count.keys(),
                 key=lambda ruleset: (
                     self._rule_application_count[ruleset][prediction_type]
                 )
             ):
-                correct_column_src = {
-                    Tabulator.CORRECT: self.correct_predictions,
-                    Tabulator.INCORRECT: self.missed_predictions
-                }[prediction_type]
-
-                row_src = self.prediction_dicts_map[prediction_type]
-
-                row_inclusion_predicate = {
-                    Tabulator.INCORRECT: lambda ur: ur in self.missed_predictions,
-                    Tabulator.CORRECT: lambda _: True  # noop
-                }[prediction_type]
-
                 applicable_predictions = [
                     {
                         Tabulator.UR: ur,
-                        PREDICTED_SR: prediction[Tabulator.SR],
+                        PREDICTED_SR: row_src[ur][Tabulator.SR],
                         CORRECT_SR: correct_column_src[ur][Tabulator.SR]
-                    } for ur, prediction
-                    in row_src.items()
-                    if ruleset == prediction[Tabulator.RULES] and (
-                        row_inclusion_predicate(ur)
-                    )
+                    } for ur
+                    in self.urs_for_signature(ruleset, prediction_type)
+                    if row_inclusion_predicate(ur)
                 ]
 
                 writer.writerow({Tabulator.UR: ruleset})
@@ -251,6 +625,25 @@ def get_parser():
     parser.add_argument("--correct", action='store_const', const=Tabulator.CORRECT)
     parser.add_argument("--incorrect", action='store_const', const=Tabulator.INCORRECT)
     parser.add_argument("--exception-dest", type=str, help="output file")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="tabulate across this many worker processes")
+    parser.add_argument("--memo-stats", action="store_true",
+                        help="report transduction memo hit rates on stderr")
+    parser.add_argument("--profile", action="store_true",
+                        help="report per-rule transduction time, calls, changes and "
+                             "input lengths on stderr (tabulates serially)")
+    parser.add_argument("--profile-json", type=str, metavar="FILE",
+                        help="with --profile, also write the profile as JSON")
+    parser.add_argument("--profile-sort", type=str, default="seconds",
+                        choices=["seconds", "calls", "changes", "change_rate", "us_per_call"],
+                        help="with --profile, the column to sort the table by")
+    parser.add_argument("--from-store", type=str, nargs="?", const="",
+                        default=None, metavar="RUN",
+                        help="with --count or --examples, read predictions and "
+                             "signatures from a stored run (the latest by default)")
+    parser.add_argument("--no-fst-cache", action="store_true",
+                        help="compile every rule and lexicon rather than loading "
+                             "unchanged ones from grammar/cache/fst")
     return parser
 
 
@@ -258,11 +651,26 @@ def main():
     parser = get_parser()
     args = parser.parse_args()
 
-    tabulator = Tabulator(grammar_file_name=args.grammar)
+    if args.no_fst_cache:
+        Ruleset.FST_CACHE_DIR = None
+
+    if args.from_store is not None:
+        from store import PredictionStore
+        store = PredictionStore()
+        run_id = store.run_id(args.from_store or None)
+        tabulator = store.tabulator(run_id, grammar_file_name=args.grammar)
+        store.close()
+    else:
+        tabulator = Tabulator(grammar_file_name=args.grammar)
 
     if args.correct and args.incorrect:
         raise Exception('Das absurde!')
 
+    if args.profile:
+        # Worker processes have their own rulesets, so profile in process.
+        args.jobs = 1
+        tabulator.ruleset.enable_profile()
+
     if args.word:
         derivation = tabulator.derivation_for_word(args.word)
         print('DERIVATION:', derivation)
@@ -272,9 +680,10 @@ def main():
             print(derivation)
             print("\n")
     elif args.count:
-        tabulator.tabulate()
+        if args.from_store is None:
+            tabulator.tabulate(jobs=args.jobs)
 
-        if args.dest:
+        if args.exception_dest:
             tabulator.write_tabulation_count(file=args.exception_dest)
         else:
             prediction_type = args.correct or args.incorrect or None
@@ -284,9 +693,10 @@ def main():
                 )
             )
     elif args.examples:
-        tabulator.tabulate()
+        if args.from_store is None:
+            tabulator.tabulate(jobs=args.jobs)
 
-        if args.dest:
+        if args.exception_dest:
             tabulator.write_tabulation_examples(
                 file=args.exception_dest)
         else:
@@ -297,6 +707,12 @@ def main():
                 )
             )
 
+    if args.memo_stats:
+        tabulator.print_memo_stats()
+
+    if args.profile:
+        tabulator.write_profile(json_file=args.profile_json, sort=args.profile_sort)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,25 @@
+import sys
+import time
+from contextlib import contextmanager
+
+
+# (component, seconds), in the order they finished.
+TIMINGS = []
+
+
+@contextmanager
+def timed(component):
+    """Record the wall time spent in the block under `component`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.append((component, time.perf_counter() - start))
+
+
+def report(file=sys.stderr):
+    width = max([len(component) for component, _ in TIMINGS] + [len("TOTAL")])
+    for component, seconds in TIMINGS:
+        print("%-*s %9.2f ms" % (width, component, seconds * 1000), file=file)
+    total = sum(seconds for _, seconds in TIMINGS)
+    print("%-*s %9.2f ms" % (width, "TOTAL", total * 1000), file=file)
@@ -0,0 +1,3 @@
+from util.commands import main
+
+main()
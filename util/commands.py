@@ -0,0 +1,161 @@
+import os
+import sys
+import argparse
+from collections import OrderedDict
+import align
+import segments
+from util.predictions import PredictionFile, write_predictions
+
+
+GRAMMAR = 'grammar'
+PREDICTIONS = os.path.join(GRAMMAR, 'predictions')
+CORRECT_MADE = os.path.join(PREDICTIONS, 'correct-made.txt')
+CORRECT_MISSED = os.path.join(PREDICTIONS, 'correct-missed.txt')
+INCORRECT_MADE = os.path.join(PREDICTIONS, 'incorrect-made.txt')
+
+TABULATED = os.path.join(PREDICTIONS, 'incorrect-tabulated.txt')
+
+
+def filter_predictions(args):
+    """Keep the URs whose SRs differ in both files, and append the rest to
+    a third."""
+    with PredictionFile(args.file1) as f1, PredictionFile(args.file2) as f2:
+        different1, different2, same = {}, {}, {}
+        for ur, sr in f1.items():
+            other = f2[ur]
+            if sr != other:
+                different1[ur] = sr
+                different2[ur] = other
+            else:
+                same[ur] = sr
+
+    # Both inputs are read in full before either is rewritten.
+    write_predictions(args.file1, different1)
+    write_predictions(args.file2, different2)
+    with open(args.same, "a") as f:
+        for ur, sr in same.items():
+            f.write(ur + "\t" + sr + "\n")
+
+
+def set_diff(args):
+    """The URs of each file missing from the other."""
+    with PredictionFile(args.file1) as f1, PredictionFile(args.file2) as f2:
+        for ur in f1.keys() - f2.keys():
+            print(ur, f1[ur])
+        print("\n")
+        for ur in f2.keys() - f1.keys():
+            print(ur, f2[ur])
+
+
+def dist(args):
+    """URs whose incorrect SR has exactly one segment, `char`, that the
+    correct SR lacks."""
+    print(args.char)
+    tokenizer = segments.default()
+
+    with PredictionFile(args.correct) as correct, PredictionFile(args.incorrect) as incorrect:
+        for ur, cor in correct.items():
+            inc = incorrect[ur]
+
+            if set(tokenizer(inc)).difference(tokenizer(cor)) == {args.char}:
+                print("%s" % ur)
+                print("\t%s" % cor)
+                print("\t%s" % inc)
+                print("\n")
+
+
+def collect_dist(args):
+    """Incorrect predictions clustered by their alignment to the correct
+    SRs; see align.py."""
+    with PredictionFile(args.correct) as correct, PredictionFile(args.incorrect) as incorrect:
+        correct_dict = correct.to_dict()
+        incorrect_dict = {ur: incorrect[ur] for ur in correct_dict if ur in incorrect}
+    align.Clusters.from_dicts(correct_dict, incorrect_dict, jobs=args.jobs).write()
+
+
+def fix_predictions(args):
+    """Move incorrect predictions that match a missed correct SR to the
+    correct predictions, and tabulate the remaining incorrect predictions
+    against the SRs they missed."""
+    with PredictionFile(args.correct_made) as correct_made_f, \
+         PredictionFile(args.correct_missed) as correct_missed_f, \
+         PredictionFile(args.incorrect_made) as incorrect_made_f:
+
+        correct_made = correct_made_f.to_dict()
+        correct_missed = correct_missed_f.to_dict()
+        incorrect_made = incorrect_made_f.to_dict()
+
+    new_correct_made = dict(correct_made)
+    new_correct_missed = dict(correct_missed)
+    new_incorrect_made = dict(incorrect_made)
+
+    for ur, sr in incorrect_made.items():
+        if ur in correct_missed and correct_missed[ur] == sr:
+            new_correct_made[ur] = sr
+            del new_correct_missed[ur]
+            del new_incorrect_made[ur]
+
+    write_predictions(args.correct_made, new_correct_made)
+    write_predictions(args.correct_missed, new_correct_missed)
+    write_predictions(args.incorrect_made, new_incorrect_made)
+
+    table = OrderedDict(
+        (ur, (incorrect_made[ur], correct_missed[ur]))
+        for ur in sorted(new_incorrect_made.keys())
+        if ur in correct_missed
+    )
+    write_predictions(args.tabulated, table)
+
+
+def index(args):
+    """Build (or check) the UR index of each file."""
+    for path in args.files:
+        with PredictionFile(path) as predictions:
+            print("%s\t%d" % (path, len(predictions)), file=sys.stderr)
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m util", description="Utilities over prediction files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("filter", help=filter_predictions.__doc__)
+    sub.add_argument("file1", type=str)
+    sub.add_argument("file2", type=str)
+    sub.add_argument("same", type=str, help="appended with URs whose SRs agree")
+    sub.set_defaults(run=filter_predictions)
+
+    sub = subparsers.add_parser("set-diff", help=set_diff.__doc__)
+    sub.add_argument("file1", type=str)
+    sub.add_argument("file2", type=str)
+    sub.set_defaults(run=set_diff)
+
+    sub = subparsers.add_parser("dist", help=dist.__doc__)
+    sub.add_argument("char", type=str)
+    sub.add_argument("correct", type=str)
+    sub.add_argument("incorrect", type=str)
+    sub.set_defaults(run=dist)
+
+    sub = subparsers.add_parser("collect-dist", help=collect_dist.__doc__)
+    sub.add_argument("correct", type=str)
+    sub.add_argument("incorrect", type=str)
+    sub.add_argument("--jobs", type=int, default=1)
+    sub.set_defaults(run=collect_dist)
+
+    sub = subparsers.add_parser("fix-predictions", help=fix_predictions.__doc__)
+    sub.add_argument("--correct-made", type=str, default=CORRECT_MADE)
+    sub.add_argument("--correct-missed", type=str, default=CORRECT_MISSED)
+    sub.add_argument("--incorrect-made", type=str, default=INCORRECT_MADE)
+    sub.add_argument("--tabulated", type=str, default=TABULATED)
+    sub.set_defaults(run=fix_predictions)
+
+    sub = subparsers.add_parser("index", help=index.__doc__)
+    sub.add_argument("files", type=str, nargs="+")
+    sub.set_defaults(run=index)
+
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.run(args)
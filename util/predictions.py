@@ -0,0 +1,168 @@
+import os
+import json
+import mmap
+import stat
+import hashlib
+from snapshot import CACHE_DIR
+
+
+INDEX_DIR = os.path.join(CACHE_DIR, "index")
+INDEX_VERSION = 1
+
+
+def index_path(path, index_dir=INDEX_DIR):
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(index_dir, "%s.%s.json" % (os.path.basename(path), name))
+
+
+def save_index(path, stamp, offsets, index_dir=INDEX_DIR):
+    os.makedirs(index_dir, exist_ok=True)
+    index_file = index_path(path, index_dir)
+    with open(index_file + ".tmp", "w") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "path": os.path.abspath(path),
+            "stamp": stamp,
+            "offsets": offsets,
+        }, f)
+    os.replace(index_file + ".tmp", index_file)
+
+
+class PredictionFile:
+    """Read-only, memory-mapped view of a prediction file: a UR and its SR
+    (or further tab separated columns) per line.
+
+    Lookups go through a hash index of UR -> byte offset of its line. The
+    index is saved under data/cache/index, stamped with the file's size and
+    modification time, so later runs over an unchanged file load it rather
+    than scanning the file again. As with a dict built from the file, the
+    last line for a UR wins. Iterating goes through the index too, in the
+    order URs first appear. Pipes and other files that can't be mapped are
+    read into memory and never indexed on disk.
+    """
+
+    def __init__(self, path, index_dir=INDEX_DIR):
+        self.path = path
+        self.index_dir = index_dir
+
+        self._mmap = None
+        self._bytes = b""
+        with open(path, "rb") as f:
+            file_stat = os.fstat(f.fileno())
+            if not stat.S_ISREG(file_stat.st_mode):
+                self._bytes = f.read()
+            elif file_stat.st_size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.indexed = stat.S_ISREG(file_stat.st_mode)
+        self.stamp = [file_stat.st_size, file_stat.st_mtime_ns]
+
+        self._offsets = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    @property
+    def data(self):
+        return self._mmap if self._mmap is not None else self._bytes
+
+    def lines(self):
+        """(offset, line) for each line with a UR on it."""
+        data, pos = self.data, 0
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            end = len(data) if end < 0 else end + 1
+            line = data[pos:end]
+            if line.strip():
+                yield pos, line
+            pos = end
+
+    @staticmethod
+    def parse(line):
+        """(UR, [other columns]) of a line."""
+        ur, *rest = line.decode().split(None, 1)
+        return ur, rest[0].rstrip("\n").split("\t") if rest else []
+
+    @property
+    def offsets(self):
+        """{UR: offset of its line}, loaded or built and saved."""
+        if self._offsets is None:
+            self._offsets = self._load_index() if self.indexed else None
+            if self._offsets is None:
+                self._offsets = {self.parse(line)[0]: pos for pos, line in self.lines()}
+                if self.indexed:
+                    save_index(self.path, self.stamp, self._offsets, self.index_dir)
+        return self._offsets
+
+    def _load_index(self):
+        try:
+            with open(index_path(self.path, self.index_dir)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get("version") != INDEX_VERSION or index.get("stamp") != self.stamp:
+            return None
+        return index["offsets"]
+
+    def columns(self, ur):
+        data = self.data
+        pos = self.offsets[ur]
+        end = data.find(b"\n", pos)
+        return self.parse(data[pos:end if end >= 0 else len(data)])[1]
+
+    def __getitem__(self, ur):
+        """The SR of a UR; the remaining columns joined by tabs for files
+        with more than two."""
+        return "\t".join(self.columns(ur))
+
+    def get(self, ur, default=None):
+        return self[ur] if ur in self else default
+
+    def __contains__(self, ur):
+        return ur in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+    def items(self):
+        """(UR, SR) in file order, last line for a UR winning."""
+        if not self.indexed:
+            parse = self.parse
+            return {
+                ur: "\t".join(columns)
+                for ur, columns in (parse(line) for _, line in self.lines())
+            }.items()
+        return ((ur, self[ur]) for ur in self.offsets)
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def write_predictions(path, predictions, index_dir=INDEX_DIR):
+    """Write {UR: SR or tuple of columns} as tab separated lines, replacing
+    `path` only once the whole file is written, and save its index."""
+    offsets = {}
+    pos = 0
+    with open(path + ".tmp", "wb") as f:
+        for ur, sr in predictions.items():
+            line = ("%s\t%s\n" % (ur, "\t".join(sr) if isinstance(sr, tuple) else sr)).encode()
+            offsets[ur] = pos
+            f.write(line)
+            pos += len(line)
+    os.replace(path + ".tmp", path)
+
+    file_stat = os.stat(path)
+    save_index(path, [file_stat.st_size, file_stat.st_mtime_ns], offsets, index_dir)
@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import glob
+import time
+import signal
+import traceback
+import lexc
+from tabulate import GRAMMAR, UR_LEXICON, SR_LEXICON, Tabulator, read_ruleset
+from evaluation import Evaluation
+from cascade import IncrementalEvaluator
+
+INTERVAL = 0.5
+
+# Signatures to report per update, largest changes first.
+TOP = 20
+
+SOURCE = re.compile(r'\s*source\s+(\S+)')
+
+
+def sourced_files(grammar_file_name, fomalines):
+    """Files the grammar `source`s, relative to its directory as in foma."""
+    directory = os.path.dirname(grammar_file_name)
+    return [
+        os.path.normpath(os.path.join(directory, match.group(1)))
+        for match in map(SOURCE.match, fomalines) if match
+    ]
+
+
+class Watcher:
+    """Keep a grammar's evaluation in memory and redo it when its files
+    change.
+
+    Polls the .foma and .lexc files in the grammar directory. A change to
+    the grammar or a file it sources recompiles the ruleset, and words
+    restart from their in-memory forms before the first rule whose
+    definition or position changed. A change to the UR lexicon only runs
+    new words through the cascade, and a change to the SR lexicon only
+    re-splits the predictions. Other files are ignored.
+    """
+
+    def __init__(self, grammar_file_name, ur_lexicon=UR_LEXICON, sr_lexicon=SR_LEXICON,
+                 directory=GRAMMAR, interval=INTERVAL, write_predictions=False, file=sys.stdout):
+        self.grammar_file_name = os.path.normpath(grammar_file_name)
+        self.ur_lexicon = os.path.normpath(ur_lexicon)
+        self.sr_lexicon = os.path.normpath(sr_lexicon)
+        self.directory = directory
+        self.interval = interval
+        self.write_predictions = write_predictions
+        self.file = file
+
+        self.evaluator = None
+        self.counts = {}
+        self.accuracy = None
+
+    def watched(self):
+        paths = glob.glob(os.path.join(self.directory, '*.foma')) + \
+            glob.glob(os.path.join(self.directory, '*.lexc')) + \
+            [self.grammar_file_name, self.ur_lexicon, self.sr_lexicon]
+        return {os.path.normpath(path) for path in paths}
+
+    def stat(self):
+        """{path: mtime} of the watched files that exist."""
+        mtimes = {}
+        for path in self.watched():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def read_grammar(self):
+        with open(self.grammar_file_name) as grammar_file:
+            fomalines = [line.rstrip() for line in grammar_file]
+        ruleset = read_ruleset(self.grammar_file_name)
+        self.grammar_files = {self.grammar_file_name} | set(
+            sourced_files(self.grammar_file_name, fomalines))
+
+        # Only the first evaluator reads the on-disk cache; later ones
+        # start from their predecessor's forms.
+        evaluator = IncrementalEvaluator(ruleset, fomalines)
+        if self.evaluator is not None:
+            evaluator.resume_from(self.evaluator)
+        self.ruleset, self.evaluator = ruleset, evaluator
+
+    def load(self):
+        self.read_grammar()
+        self.ur_pairs = lexc.read_pairs(self.ur_lexicon)
+        self.sr_pairs = lexc.read_pairs(self.sr_lexicon)
+
+    def update(self, changed):
+        """Reload whatever the changed files affect. Returns False if none
+        of them matter."""
+        grammar = bool(changed & self.grammar_files)
+        if grammar:
+            self.read_grammar()
+        if self.ur_lexicon in changed:
+            self.ur_pairs = lexc.read_pairs(self.ur_lexicon)
+        if self.sr_lexicon in changed:
+            self.sr_pairs = lexc.read_pairs(self.sr_lexicon)
+        return grammar or bool(changed & {self.ur_lexicon, self.sr_lexicon})
+
+    def evaluate(self):
+        evaluator = self.evaluator
+        evaluator.transductions = evaluator.reused = 0
+
+        evaluation = Evaluation(
+            self.ruleset, self.ur_pairs, self.sr_pairs, evaluator=evaluator)
+        tabulator = Tabulator(
+            grammar_file_name=self.grammar_file_name,
+            predictions=evaluation.prediction_dicts,
+            ruleset=self.ruleset)
+        tabulator.tabulate(evaluator=evaluator)
+
+        if self.write_predictions:
+            evaluation.write()
+        return evaluation, tabulator
+
+    def report(self, evaluation, tabulator, seconds):
+        counts = {
+            signature: (row[Tabulator.CORRECT], row[Tabulator.INCORRECT])
+            for signature, row in tabulator.rule_application_count().items()
+        }
+
+        accuracy = evaluation.accuracy
+        delta = '' if self.accuracy is None else ' (%+.4f)' % (accuracy - self.accuracy)
+        print('%s accuracy %.4f%s: %d correct, %d missed, %d incorrect. '
+              'Restarted at rule %d of %d, %d transductions, %.2f s.' % (
+                  time.strftime('%H:%M:%S'), accuracy, delta,
+                  len(evaluation.correct_made), len(evaluation.correct_missed),
+                  len(evaluation.incorrect_made), self.evaluator.restart_idx,
+                  len(self.evaluator.chain), self.evaluator.transductions, seconds),
+              file=self.file)
+
+        changes = []
+        for signature in set(counts) | set(self.counts):
+            correct, incorrect = counts.get(signature, (0, 0))
+            old_correct, old_incorrect = self.counts.get(signature, (0, 0))
+            if (correct, incorrect) != (old_correct, old_incorrect):
+                changes.append((signature, correct, correct - old_correct,
+                                incorrect, incorrect - old_incorrect))
+        changes.sort(key=lambda row: (-abs(row[4]), -abs(row[2]), row[0]))
+
+        for signature, correct, correct_delta, incorrect, incorrect_delta in changes[:TOP]:
+            print('\t%d (%+d)\t%d (%+d)\t%s' % (
+                correct, correct_delta, incorrect, incorrect_delta, signature or '[]'),
+                file=self.file)
+        if len(changes) > TOP:
+            print('\t... %d more signatures changed' % (len(changes) - TOP), file=self.file)
+
+        self.counts = counts
+        self.accuracy = accuracy
+
+    def run(self):
+        """Evaluate, then poll until interrupted. Errors in an edit (e.g. a
+        grammar that doesn't compile) are printed and the previous state
+        kept until the next save. The evaluator's cache is saved on exit."""
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        mtimes = self.stat()
+        start = time.perf_counter()
+        self.load()
+        evaluation, tabulator = self.evaluate()
+        self.report(evaluation, tabulator, time.perf_counter() - start)
+        print('Watching %s for changes.' % self.directory, file=self.file)
+        self.file.flush()
+
+        try:
+            while True:
+                time.sleep(self.interval)
+                new_mtimes = self.stat()
+                changed = {
+                    path for path in set(mtimes) | set(new_mtimes)
+                    if mtimes.get(path) != new_mtimes.get(path)
+                }
+                mtimes = new_mtimes
+                if not changed:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    if not self.update(changed):
+                        continue
+                    evaluation, tabulator = self.evaluate()
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+                    print('Keeping the last evaluation.', file=sys.stderr)
+                    continue
+                print('Changed: %s' % ', '.join(sorted(changed)), file=self.file)
+                self.report(evaluation, tabulator, time.perf_counter() - start)
+                self.file.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.evaluator is not None:
+                self.evaluator.save()